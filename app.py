@@ -1,17 +1,87 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, has_request_context, request, jsonify, stream_with_context
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timezone
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 import sqlite3
+import click
 from math import floor
+from metrics import ContextThreadPoolExecutor
+from fanout import fan_out, fan_out_as_completed, FanOutCancelled, API_HOST, STORE_HOST
+from cache import LRUCache, SingleFlight
+from array import array
+import threading
+import statistics
+import bisect
+import heapq
 import requests
+import steam_client
+import metrics
+import jobs
+import contextlib
+import socket
+import functools
+import hashlib
+import json
+import gzip
 import time
 import os
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 
 app = Flask(__name__)
 CORS(app)
+metrics.init_app(app)
+
+
+#
+# Stale responses
+# When Steam can't be reached, helpers fall back to the last data they have and call mark_stale().
+# The response then gets a Warning header, and JSON objects get "stale": true.
+# Calls that fail fast because of an open circuit breaker (steam_client.SteamUnavailable) and aren't handled become a 503.
+#
+def mark_stale():
+    if has_request_context():
+        g.stale = True
+
+
+@app.after_request
+def mark_stale_response(response):
+    if g.get('stale'):
+        response.headers['Warning'] = '110 - "Response is Stale"'
+        if response.status_code == 200 and response.is_json and 'Content-Encoding' not in response.headers:
+            body = response.get_json()
+            if isinstance(body, dict):
+                body['stale'] = True
+                response.set_data(app.json.dumps(body))
+    return response
+
+
+@app.errorhandler(steam_client.SteamUnavailable)
+def steam_unavailable(e):
+    response = jsonify({'error': str(e)})
+    response.status_code = 503
+    if e.retry_after:
+        response.headers['Retry-After'] = str(int(e.retry_after) + 1)
+    return response
+
+
+#
+# Batch helpers (get_friend_lists, get_libraries) report errors per steam id as exceptions,
+# a route whose own steam id failed answers 503 when Steam is unavailable and 500 otherwise
+#
+def fetch_error_response(error):
+    if isinstance(error, steam_client.SteamUnavailable):
+        raise error
+    return jsonify({'error': str(error)}), 500
+
+
+def error_messages(errors):
+    return {steamid: str(error) for steamid, error in errors.items()}
 
 #
 # Initial Config
@@ -19,21 +89,208 @@ CORS(app)
 #
 
 DATABASE = 'steamdata.db'
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+
+
+#
+# One pooled connection per thread (and per process, so forked workers don't share one)
+# close() only ends any open transaction, the connection stays open for the next get_db()
+#
+class PooledConnection(metrics.TimedConnection):
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def really_close(self):
+        super().close()
+
+
+db_local = threading.local()
 
 
 def get_db():
-    conn = sqlite3.connect(DATABASE)
+    conn = getattr(db_local, 'conn', None)
+    if conn is None or db_local.pid != os.getpid():
+        conn = sqlite3.connect(DATABASE, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, factory=PooledConnection)
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+        conn.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+        db_local.conn = conn
+        db_local.pid = os.getpid()
     return conn
 
 
+def add_missing_column(conn, table, column, definition):
+    # For databases created before the column existed
+    if column not in {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
 def create_tables():
     conn = get_db()
     try:
+        # WAL lets list_users readers and add_user writers work at the same time, it is stored in the db file
+        conn.execute('PRAGMA journal_mode = WAL')
         conn.execute('''
             CREATE TABLE IF NOT EXISTS users (
                 steam_id TEXT PRIMARY KEY NOT NULL
             );
         ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS appdetails_cache (
+                appid INTEGER PRIMARY KEY NOT NULL,
+                success INTEGER NOT NULL,
+                data TEXT,
+                fetched_at REAL NOT NULL
+            );
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS achievement_index (
+                appid INTEGER PRIMARY KEY NOT NULL,
+                has_achievements INTEGER NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS global_achievements (
+                appid INTEGER NOT NULL,
+                apiname TEXT NOT NULL,
+                percent REAL NOT NULL,
+                PRIMARY KEY (appid, apiname)
+            );
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS player_summaries (
+                steamid TEXT PRIMARY KEY NOT NULL,
+                personaname TEXT,
+                avatarmedium TEXT,
+                timecreated INTEGER,
+                data TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS owned_games (
+                steamid TEXT NOT NULL,
+                appid INTEGER NOT NULL,
+                name TEXT,
+                img_icon_url TEXT,
+                playtime_forever INTEGER NOT NULL DEFAULT 0,
+                playtime_2weeks INTEGER NOT NULL DEFAULT 0,
+                rtime_last_played INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (steamid, appid)
+            );
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_owned_games_appid ON owned_games (appid);')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_owned_games_playtime ON owned_games (steamid, playtime_forever DESC);')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS library_index (
+                steamid TEXT PRIMARY KEY NOT NULL,
+                appids BLOB NOT NULL,
+                playtimes BLOB NOT NULL,
+                stored_at REAL NOT NULL DEFAULT 0
+            );
+        ''')
+        add_missing_column(conn, 'library_index', 'stored_at', 'REAL NOT NULL DEFAULT 0')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS playtime_snapshots (
+                steamid TEXT NOT NULL,
+                appid INTEGER NOT NULL,
+                taken_at REAL NOT NULL,
+                playtime_forever INTEGER NOT NULL,
+                PRIMARY KEY (steamid, appid, taken_at)
+            ) WITHOUT ROWID;
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_playtime_snapshots_time ON playtime_snapshots (steamid, taken_at);')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS snapshot_runs (
+                steamid TEXT NOT NULL,
+                taken_at REAL NOT NULL,
+                PRIMARY KEY (steamid, taken_at)
+            ) WITHOUT ROWID;
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS friend_edges (
+                steamid TEXT NOT NULL,
+                friend_steamid TEXT NOT NULL,
+                relationship TEXT,
+                friend_since INTEGER,
+                PRIMARY KEY (steamid, friend_steamid)
+            );
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_friend_edges_friend ON friend_edges (friend_steamid);')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS price_catalog (
+                appid INTEGER NOT NULL,
+                cc TEXT NOT NULL,
+                currency TEXT,
+                final INTEGER NOT NULL DEFAULT 0,
+                initial INTEGER NOT NULL DEFAULT 0,
+                discount_percent INTEGER NOT NULL DEFAULT 0,
+                is_free INTEGER NOT NULL DEFAULT 0,
+                type TEXT,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (appid, cc)
+            );
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS genre_index (
+                appid INTEGER PRIMARY KEY NOT NULL,
+                indexed_at REAL NOT NULL
+            );
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS app_genres (
+                appid INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                description TEXT NOT NULL,
+                PRIMARY KEY (appid, kind, description)
+            );
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY NOT NULL,
+                type TEXT NOT NULL,
+                steamid TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                done INTEGER NOT NULL DEFAULT 0,
+                total INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_key ON jobs (type, steamid, params, created_at);')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS leaderboard_entries (
+                board TEXT NOT NULL,
+                steamid TEXT NOT NULL,
+                score REAL NOT NULL,
+                detail TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (board, steamid)
+            ) WITHOUT ROWID;
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_leaderboard_rank ON leaderboard_entries (board, score, steamid);')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS ingestion_state (
+                steamid TEXT PRIMARY KEY NOT NULL,
+                owned_games_at REAL,
+                friends_at REAL
+            );
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS background_leases (
+                name TEXT PRIMARY KEY NOT NULL,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+        ''')
         conn.commit()
     finally:
         conn.close()
@@ -48,16 +305,54 @@ def add_user(steam_id):
     conn = get_db()
     cursor = conn.cursor()
     try:
-        cursor.execute('SELECT steam_id FROM users WHERE steam_id = ?', (steam_id,))
-        if cursor.fetchone():
-            return jsonify({'error': 'User already exists'}), 409
-        cursor.execute('INSERT INTO users (steam_id) VALUES (?)', (steam_id,))
+        cursor.execute('INSERT INTO users (steam_id) VALUES (?) ON CONFLICT(steam_id) DO NOTHING', (steam_id,))
         conn.commit()
+        if cursor.rowcount == 0:
+            return jsonify({'error': 'User already exists'}), 409
         return jsonify({'message': 'User added'}), 201
     finally:
         conn.close()
 
 
+#
+# Bulk registration
+# Takes a JSON body {"steam_ids": [...]} (or just the list) and registers all of them in one transaction
+# Returns which ids were inserted, which were already registered, and which aren't valid steam ids
+#
+@app.route('/add_users', methods=['POST'])
+def add_users():
+    body = request.get_json(silent=True)
+    steam_ids = body.get('steam_ids') if isinstance(body, dict) else body
+    if not isinstance(steam_ids, list):
+        return jsonify({'error': 'Expected a JSON list of steam ids or {"steam_ids": [...]}'}), 400
+
+    steam_ids = list(dict.fromkeys(str(steam_id).strip() for steam_id in steam_ids))
+    invalid = [steam_id for steam_id in steam_ids if not steam_id.isdigit()]
+    steam_ids = [steam_id for steam_id in steam_ids if steam_id.isdigit()]
+
+    conn = get_db()
+    try:
+        # Take the write lock up front so the duplicate check and the insert see the same table
+        conn.execute('BEGIN IMMEDIATE')
+        existing = set()
+        for i in range(0, len(steam_ids), SQLITE_MAX_PARAMS):
+            chunk = steam_ids[i:i + SQLITE_MAX_PARAMS]
+            placeholders = ','.join('?' * len(chunk))
+            existing.update(row[0] for row in conn.execute(f'SELECT steam_id FROM users WHERE steam_id IN ({placeholders})', chunk))
+
+        inserted = [steam_id for steam_id in steam_ids if steam_id not in existing]
+        conn.executemany('INSERT INTO users (steam_id) VALUES (?)', [(steam_id,) for steam_id in inserted])
+        conn.commit()
+    finally:
+        conn.close()
+
+    return jsonify({
+        'inserted': inserted,
+        'duplicates': [steam_id for steam_id in steam_ids if steam_id in existing],
+        'invalid': invalid
+    }), 201 if inserted else 200
+
+
 @app.route('/users')
 def list_users():
     conn = get_db()
@@ -66,9 +361,8 @@ def list_users():
         cursor.execute('SELECT steam_id FROM users')
         users = cursor.fetchall()
         user_details = []
-        for user in users:
-            steam_id = user[0]
-            details = fetch_steam_user_details(steam_id)
+        steam_ids = [user[0] for user in users]
+        for steam_id, details in zip(steam_ids, resolve_player_summaries(steam_ids, fresh=wants_fresh())):
             if 'error' not in details:
                 user_info = {
                     'steam_id': steam_id,
@@ -84,15 +378,41 @@ def list_users():
 
 
 
-def fetch_steam_user_details(steam_id):
-    url = f'http://api.steampowered.com/ISteamUser/GetPlayerSummaries/v0002/?key={api_key}&steamids={steam_id}'
-    try:
-        response = requests.get(url)
-        response.raise_for_status()  # This will raise an exception for HTTP errors
-        data = response.json()
-        return data['response']['players'][0] if data['response']['players'] else {}
-    except requests.RequestException as e:
-        return {"error": str(e)}
+#
+# Batched player summaries
+# GetPlayerSummaries accepts up to 100 comma separated steamids per call,
+# so ids are chunked, chunks are fetched concurrently, and results are
+# returned in the same order as the input ids.
+# Ids that failed or were not found come back as {'steamid': ..., 'error': ...}
+#
+PLAYER_SUMMARIES_BATCH_SIZE = 100
+PLAYER_SUMMARIES_MAX_WORKERS = 8
+
+
+def get_player_summaries_batch(steam_ids):
+    steam_ids = [str(steam_id) for steam_id in steam_ids]
+    unique_ids = list(dict.fromkeys(steam_ids))
+    chunks = [unique_ids[i:i + PLAYER_SUMMARIES_BATCH_SIZE] for i in range(0, len(unique_ids), PLAYER_SUMMARIES_BATCH_SIZE)]
+
+    def fetch_chunk(chunk):
+        url = f'http://api.steampowered.com/ISteamUser/GetPlayerSummaries/v0002/?key={api_key}&steamids={",".join(chunk)}'
+        response = steam_client.get(url)
+        response.raise_for_status()
+        return response.json().get('response', {}).get('players', [])
+
+    players = {}
+    errors = {}
+    for chunk, chunk_players, error in fan_out(fetch_chunk, chunks, PLAYER_SUMMARIES_MAX_WORKERS, API_HOST):
+        if error:
+            errors.update(dict.fromkeys(chunk, str(error)))
+        else:
+            players.update({player['steamid']: player for player in chunk_players})
+
+    return [
+        players[steam_id] if steam_id in players
+        else {'steamid': steam_id, 'error': errors.get(steam_id, 'Player not found')}
+        for steam_id in steam_ids
+    ]
 
 
 
@@ -123,10 +443,12 @@ def get_steam_user(steam_id=None):
     url = f'http://api.steampowered.com/ISteamUser/GetPlayerSummaries/v0002/?key={api_key}&steamids={steam_id}'
 
     try:
-        response = requests.get(url)
+        response = steam_client.get(url)
         response.raise_for_status()
         data = response.json()  # Always fetch the data
 
+    except steam_client.SteamUnavailable:
+        raise
     except requests.RequestException as e:
         return {"error": str(e)}
     
@@ -141,7 +463,7 @@ def get_steam_user(steam_id=None):
 
 #
 # Endpoint for returning Friends list
-# Returns steam ids, then steam ids are fed into get_steam_user
+# Friend lists come from friend_edges while fresh (see get_friend_lists), then steam ids are resolved in batches
 # Takes in url param "steamid"
 #
 @app.route('/steam/api/friends', methods=['GET'])
@@ -149,39 +471,43 @@ def get_friends_list():
 
     steam_id = request.args.get('steamid')
     amount = int(request.args.get('amount', '10'))
-    print(amount)
-    friends_list = []
-
-    url = f'http://api.steampowered.com/ISteamUser/GetFriendList/v0001/?key={api_key}&steamid={steam_id}&relationship=friend'
-    
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        friends_list = response.json()["friendslist"]["friends"]
-
-    except requests.RequestException as e:
-        return jsonify(error=str(e)), 500
+    friend_lists, errors = get_friend_lists([steam_id], fresh=wants_fresh())
+    if steam_id in errors:
+        return fetch_error_response(errors[steam_id])
+    friends_list = friend_lists[steam_id]
 
     friends_info = []
 
-    for friend in friends_list[:amount]:
-        friend_id = friend["steamid"]
-        friend_data = get_steam_user(friend_id)
+    # Resolve all friends in batched GetPlayerSummaries calls instead of one call per friend
+    friend_ids = [friend["steamid"] for friend in friends_list[:amount]]
+    for friend_data in resolve_player_summaries(friend_ids, fresh=wants_fresh()):
         if 'error' not in friend_data:
-            # This check is crucial to ensure that you're accessing 'response' on a valid data structure
-            if 'response' in friend_data and 'players' in friend_data['response']:
-                friends_info.append(friend_data['response']['players'][0])
-            else:
-                print(f"No player data found for {friend_id}")
+            friends_info.append(friend_data)
         else:
-            print(f"Error fetching data for {friend_id}: {friend_data['error']}")
-
-        if len(friends_info) >= amount:
-            break
+            print(f"Error fetching data for {friend_data['steamid']}: {friend_data['error']}")
 
     return jsonify(friends_info)
 
 
+def fetch_friend_list(steamid):
+    url = f'http://api.steampowered.com/ISteamUser/GetFriendList/v0001/?key={api_key}&steamid={steamid}&relationship=friend'
+    response = steam_client.get(url)
+    response.raise_for_status()
+    return response.json()["friendslist"]["friends"]
+
+
+#
+# Like fetch_friend_list, but a private friend list (Steam answers 401) is an empty one
+#
+def fetch_visible_friend_list(steamid):
+    try:
+        return fetch_friend_list(steamid)
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code in (401, 403):
+            return []
+        raise
+
+
 
 
 #
@@ -195,12 +521,8 @@ def get_most_played():
     if not steam_id:
         return jsonify({"error": "Steam ID is required"}), 400
 
-    url = f"http://api.steampowered.com/IPlayerService/GetOwnedGames/v0001/?key={api_key}&steamid={steam_id}&format=json&include_played_free_games=1&include_appinfo=1"
-
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
+        data = get_owned_games(steam_id, fresh=wants_fresh())
 
         games = data.get("response", {}).get("games", [])
 
@@ -210,57 +532,65 @@ def get_most_played():
         top_games = filtered_games[:20]
 
         # Prepare the response with the necessary details
-        most_played_games = [
-            {
-                "appid": game["appid"],
-                "title": game["name"], 
-                "imageurl": f"https://steamcdn-a.akamaihd.net/steam/apps/{game['appid']}/header.jpg",
-                "playtime_forever": game["playtime_forever"]
-            } for game in top_games
-        ]
+        most_played_games = [most_played_entry(game) for game in top_games]
         
         return jsonify(most_played_games)
     
+    except steam_client.SteamUnavailable:
+        raise
     except requests.RequestException as e:
         return jsonify({"error": str(e)}), 500
 
 
+def most_played_entry(game):
+    return {
+        "appid": game["appid"],
+        "title": game["name"], 
+        "imageurl": f"https://steamcdn-a.akamaihd.net/steam/apps/{game['appid']}/header.jpg",
+        "playtime_forever": game["playtime_forever"]
+    }
+
+
 
 #
 # Endpoint to return top 3 categories
 # Takes in url param steamid
+# 'mode=library' returns the playtime weighted genre and category shares of the whole library instead
 #
 @app.route('/steam/api/top_categories', methods=['GET'])
 def top_categories():
 
     steam_id = request.args.get('steamid')
 
-    owned_games_url = f"http://api.steampowered.com/IPlayerService/GetOwnedGames/v0001/?key={api_key}&steamid={steam_id}&include_appinfo=true&format=json"
-    response = requests.get(owned_games_url)
-    games_data = response.json().get('response', {}).get('games', [])
-    
+    games_data = get_owned_games(steam_id, fresh=wants_fresh()).get('response', {}).get('games', [])
+
+    if request.args.get('mode') == 'library':
+        return jsonify(genre_profile(games_data))
+
     # Sort games by playtime and limit to top 10
     top_games = sorted(games_data, key=lambda x: x['playtime_forever'], reverse=True)[:10]
 
-    # Fetch game details and collect genres
-    genres_count = {}
-    exclude_keywords = ['Steam', 'support', 'controller']
+    return jsonify(count_top_genres(top_games))
 
-    for game in top_games:
-        app_details_url = f"http://store.steampowered.com/api/appdetails?appids={game['appid']}"
-        details_response = requests.get(app_details_url)
 
-        details_data = details_response.json().get(str(game['appid']), {}).get('data', {})
-        
-        for genre in details_data.get('genres', []):
-            description = genre.get('description')
-            if description and not any(keyword.lower() in description.lower() for keyword in exclude_keywords):
-                genres_count[description] = genres_count.get(description, 0) + 1
-    
-    # Determine top 3 genres
-    top_genres = sorted(genres_count.items(), key=lambda x: x[1], reverse=True)[:5]
-    
-    return jsonify(top_genres)
+def count_top_genres(top_games):
+    # Count genres from the local genre index
+    refresh_genre_index(top_games)
+    conn = get_db()
+    try:
+        load_library_appids(conn, [game['appid'] for game in top_games])
+        genres_count = conn.execute('''
+            SELECT a.description, COUNT(*) FROM library_appids l
+            JOIN app_genres a ON a.appid = l.appid AND a.kind = 'genres'
+            GROUP BY a.description ORDER BY COUNT(*) DESC, a.description
+        ''').fetchall()
+    finally:
+        conn.close()
+
+    # Determine top genres
+    top_genres = [(description, count) for description, count in genres_count if not is_excluded_genre(description)][:5]
+
+    return top_genres
 
 
 
@@ -268,196 +598,966 @@ def top_categories():
 #
 # Helper methods
 #
-def get_owned_games(steamid):
-    url = f'http://api.steampowered.com/IPlayerService/GetOwnedGames/v0001/?key={api_key}&steamid={steamid}&format=json&include_played_free_games=1&include_appinfo=1'
-    response = requests.get(url)
-    return response.json()
+#
+# Owned games are requested by most dashboard routes at the same time,
+# so concurrent fetches for one steamid share a single upstream call
+# and the parsed payload is memoized for OWNED_GAMES_TTL seconds.
+# The returned dict is shared between callers and must not be modified.
+#
+OWNED_GAMES_TTL = int(os.getenv('OWNED_GAMES_TTL', 60))
+owned_games_memo = LRUCache(maxsize=256)
+owned_games_flight = SingleFlight()
 
-def get_global_achievements(gameid):
-    url = f'http://api.steampowered.com/ISteamUserStats/GetGlobalAchievementPercentagesForApp/v0002/?gameid={gameid}&format=json'
-    response = requests.get(url)
-    return response.json()
+
+#
+# Owned games for the routes, answered from the ingested snapshot when there is a recent one
+# 'fresh' forces a live fetch
+#
+def get_owned_games(steamid, fresh=False):
+    local = None if fresh else load_local_owned_games(steamid)
+    if not fresh:
+        metrics.record_cache('ingested_owned_games', hits=local is not None, misses=local is None)
+    if local is not None:
+        return local
+    try:
+        return fetch_owned_games(steamid, use_memo=not fresh)
+    except (requests.RequestException, ValueError):
+        # Last known library, however old
+        memo = owned_games_memo.get(str(steamid))
+        stale = memo[0] if memo else load_local_owned_games(steamid, max_age=float('inf'))
+        if stale is None:
+            raise
+        mark_stale()
+        return stale
+
+
+def fetch_owned_games(steamid, use_memo=True):
+    steamid = str(steamid)
+    memo = owned_games_memo.get(steamid) if use_memo else None
+    if memo and time.time() - memo[1] < OWNED_GAMES_TTL:
+        metrics.record_cache('owned_games', hits=1)
+        return memo[0]
+    metrics.record_cache('owned_games', misses=1)
+
+    def fetch():
+        url = f'http://api.steampowered.com/IPlayerService/GetOwnedGames/v0001/?key={api_key}&steamid={steamid}&format=json&include_played_free_games=1&include_appinfo=1'
+        response = steam_client.get(url)
+        # A 429 that outlived the retries is an error too, its body isn't a library (and often isn't JSON)
+        response.raise_for_status()
+        data = response.json()
+        owned_games_memo.set(steamid, (data, time.time()))
+        return data
+
+    return owned_games_flight.do(steamid, fetch)
 
 def get_player_achievements(gameid, steamid):
     url = f'http://api.steampowered.com/ISteamUserStats/GetPlayerAchievements/v0001/?appid={gameid}&key={api_key}&steamid={steamid}'
-    response = requests.get(url)
-    return response.json()
-
-def get_player_summaries(steamid):
-    url = f'http://api.steampowered.com/ISteamUser/GetPlayerSummaries/v0002/?key={api_key}&steamids={steamid}'
-    response = requests.get(url)
+    response = steam_client.get(url)
     return response.json()
 
-def get_game_price(appid):
-    url = f'http://store.steampowered.com/api/appdetails?appids={appid}&filters=price_overview,basic'
-    response = requests.get(url)
-    data = response.json()
-    # print(data)
-    if data[str(appid)]['success']:
-        game_data = data[str(appid)]['data']
-        # Check if the item is a game
-        if 'type' in game_data and game_data['type'] == 'game':
-            if 'price_overview' in game_data:
-                if not game_data['price_overview'].get('is_free', False):
-                    price_in_cents = game_data['price_overview']['final']
-                    price_in_dollars = price_in_cents / 100.0  # Correctly converting cents to dollars
-                    return price_in_dollars
-    return 0.0
-
+def get_player_summaries(steamid, fresh=False):
+    players = [player for player in resolve_player_summaries([steamid], fresh=fresh) if 'error' not in player]
+    return {'response': {'players': players}}
 
 
 
 #
-# Getting Most Rare Acheivements
-# Is split into multiple methods for convinience
-# Utilizes above helper methods
+# App details cache
+# Full appdetails lookups go through get_app_details(), price-only batches go through fetch_price_batch() (see Price catalog)
+# Entries live in the appdetails_cache table (shared by all workers) with a hot LRU in front of it.
+# Freshness depends on the fields the caller needs, prices go stale much faster than genres.
+# Stale entries are served immediately and refreshed in the background.
 #
-@app.route('/steam/api/rare-achievements', methods=['GET'])
-def rare_achievements():
-    steamid = request.args.get('steamid')
-    owned_games_response = get_owned_games(steamid)
-    
-    if not owned_games_response or 'response' not in owned_games_response or 'games' not in owned_games_response['response']:
-        return jsonify({'error': 'Failed to fetch owned games or no games found.'}), 400
+APPDETAILS_TTL_DEFAULT = int(os.getenv('APPDETAILS_TTL_DEFAULT', 24 * 60 * 60))
+APPDETAILS_TTL_PRICE = int(os.getenv('APPDETAILS_TTL_PRICE', 60 * 60))
+APPDETAILS_TTL_STATIC = int(os.getenv('APPDETAILS_TTL_STATIC', 7 * 24 * 60 * 60))
+
+APPDETAILS_FIELD_TTLS = {
+    'price_overview': APPDETAILS_TTL_PRICE,
+    'package_groups': APPDETAILS_TTL_PRICE,
+    'is_free': APPDETAILS_TTL_PRICE,
+    'genres': APPDETAILS_TTL_STATIC,
+    'categories': APPDETAILS_TTL_STATIC,
+    'developers': APPDETAILS_TTL_STATIC,
+    'publishers': APPDETAILS_TTL_STATIC,
+}
+
+appdetails_lru = LRUCache(maxsize=int(os.getenv('APPDETAILS_LRU_SIZE', 2048)))
+appdetails_flight = SingleFlight()
+appdetails_refresh_executor = ContextThreadPoolExecutor(max_workers=4)
+appdetails_refreshing = set()
+appdetails_refreshing_lock = threading.Lock()
+
+
+def appdetails_ttl(fields=None):
+    if fields is None:
+        return min([APPDETAILS_TTL_DEFAULT] + list(APPDETAILS_FIELD_TTLS.values()))
+    return min(APPDETAILS_FIELD_TTLS.get(field, APPDETAILS_TTL_DEFAULT) for field in fields)
+
+
+def fetch_app_details(appid):
+    url = f'http://store.steampowered.com/api/appdetails?appids={appid}'
+    response = steam_client.get(url)
+    response.raise_for_status()
+    result = (response.json() or {}).get(str(appid)) or {}
+    return result.get('data') if result.get('success') else None
+
+
+def load_app_details(appid):
+    conn = get_db()
+    try:
+        row = conn.execute('SELECT success, data, fetched_at FROM appdetails_cache WHERE appid = ?', (appid,)).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    success, data, fetched_at = row
+    return (json.loads(data) if success else None, fetched_at)
 
-    owned_games = owned_games_response['response']['games']
-    rare_achievements_list = []
-    
-    for game in owned_games:
-        game_id = game['appid']
-        game_name = game['name']
-        global_achievements_response = get_global_achievements(game_id)
-        
-        # Proceed only if the global achievements response has the expected structure
-        if global_achievements_response and 'achievementpercentages' in global_achievements_response and 'achievements' in global_achievements_response['achievementpercentages']:
-            global_achievements = global_achievements_response['achievementpercentages']['achievements']
-            global_ach_dict = {ach['name']: ach['percent'] for ach in global_achievements}
-            
-            player_achievements_response = get_player_achievements(game_id, steamid)
-            # Ensure player achievements were successfully fetched
-            if 'playerstats' in player_achievements_response and 'achievements' in player_achievements_response['playerstats']:
-                for player_achievement in player_achievements_response['playerstats']['achievements']:
-                    if player_achievement.get('achieved') == 1:
-                        ach_name = player_achievement['apiname']
-                        if ach_name in global_ach_dict:
-                            rare_achievements_list.append({
-                                'game': game_name,
-                                'achievement': ach_name,
-                                'rarity': global_ach_dict[ach_name]
-                            })
-
-    # Sort achievements by rarity and return the top 10
-    rare_achievements_list.sort(key=lambda x: x['rarity'])
-    return jsonify(rare_achievements_list[:10])
+
+def store_app_details(appid, data):
+    entry = (data, time.time())
+    conn = get_db()
+    try:
+        conn.execute(
+            'INSERT OR REPLACE INTO appdetails_cache (appid, success, data, fetched_at) VALUES (?, ?, ?, ?)',
+            (appid, 1 if data is not None else 0, json.dumps(data) if data is not None else None, entry[1])
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    appdetails_lru.set(appid, entry)
+    return entry
 
 
+def refresh_app_details(appid):
+    try:
+        store_app_details(appid, fetch_app_details(appid))
+    except requests.RequestException as e:
+        print(f"Background refresh of appdetails for {appid} failed: {e}")
+    finally:
+        with appdetails_refreshing_lock:
+            appdetails_refreshing.discard(appid)
+
+
+def schedule_app_details_refresh(appid):
+    with appdetails_refreshing_lock:
+        if appid in appdetails_refreshing:
+            return
+        appdetails_refreshing.add(appid)
+    appdetails_refresh_executor.submit(refresh_app_details, appid)
+
 
 #
-# Getting total hours
-# Takes in url param 'steamid'
+# Returns the appdetails 'data' dict for an app, or None if Steam has no data for it
+# 'fields' lists the keys the caller reads, and decides how old an entry may be
+# Raises requests.RequestException if the app is not cached and Steam can't be reached
 #
-@app.route('/steam/api/total-hours', methods=['GET'])
-def total_hours():
-    steamid = request.args.get('steamid')
-    if not steamid:
-        return jsonify({'error': 'steamid parameter is required'}), 400
-    
-    owned_games_response = get_owned_games(steamid)
-    
-    if not owned_games_response or 'response' not in owned_games_response or 'games' not in owned_games_response['response']:
-        return jsonify({'error': 'Failed to fetch owned games or no games found.'}), 400
+def get_app_details(appid, fields=None):
+    appid = int(appid)
+    ttl = appdetails_ttl(fields)
+
+    entry = appdetails_lru.get(appid)
+    if entry is None or time.time() - entry[1] > ttl:
+        # Another worker may already have refreshed the shared table
+        stored = load_app_details(appid)
+        if stored is not None and (entry is None or stored[1] > entry[1]):
+            entry = stored
+            appdetails_lru.set(appid, entry)
+
+    metrics.record_cache('appdetails', hits=entry is not None, misses=entry is None)
+    if entry is None:
+        entry = appdetails_flight.do(appid, lambda: store_app_details(appid, fetch_app_details(appid)))
+    elif time.time() - entry[1] > ttl:
+        schedule_app_details_refresh(appid)
+
+    return entry[0]
 
-    total_playtime_minutes = sum(game['playtime_forever'] for game in owned_games_response['response']['games'])
-    total_playtime_hours = total_playtime_minutes / 60  # Convert minutes to hours
-    total_playtime_hours_rounded = floor(total_playtime_hours)  # Round down to the nearest whole number
-    
-    return jsonify({'steamid': steamid, 'total_hours_played': total_playtime_hours_rounded})
 
 
 
 #
-# Average hours per week
-# takes in param 'steamid'
+# Price catalog
+# Prices per (appid, cc) in the price_catalog table, filled in bulk:
+# appdetails with filters=price_overview takes many appids per call.
+# It doesn't return the app type or is_free, apps without a price_overview are stored as free,
+# and 'type' is only filled in when we already know it from the appdetails cache.
 #
-@app.route('/steam/api/average-hours-per-week', methods=['GET'])
-def average_hours_per_week():
-    steamid = request.args.get('steamid')
-    if not steamid:
-        return jsonify({'error': 'steamid parameter is required'}), 400
+PRICE_BATCH_SIZE = 100
+PRICE_MAX_WORKERS = 4
+
+
+def fetch_price_batch(appids, cc):
+    url = f'http://store.steampowered.com/api/appdetails?appids={",".join(str(appid) for appid in appids)}&filters=price_overview&cc={cc}'
+    response = steam_client.get(url)
+    response.raise_for_status()
+    data = response.json() or {}
+
+    now = time.time()
+    rows = []
+    for appid in appids:
+        result = data.get(str(appid)) or {}
+        # Free apps come back with an empty list as 'data'
+        price = (result.get('data') or {}).get('price_overview') if result.get('success') else None
+        if price:
+            rows.append((appid, cc, price.get('currency'), price.get('final', 0), price.get('initial', 0), price.get('discount_percent', 0), 0, now))
+        else:
+            rows.append((appid, cc, None, 0, 0, 0, 1 if result.get('success') else 0, now))
+    return rows
 
-    player_summary = get_player_summaries(steamid)
-    owned_games_response = get_owned_games(steamid)
 
-    if 'response' not in player_summary or 'players' not in player_summary['response'] or len(player_summary['response']['players']) == 0:
-        return jsonify({'error': 'Failed to fetch player summary.'}), 400
+def store_prices(rows):
+    conn = get_db()
+    try:
+        conn.executemany('''
+            INSERT INTO price_catalog (appid, cc, currency, final, initial, discount_percent, is_free, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(appid, cc) DO UPDATE SET
+                currency = excluded.currency, final = excluded.final, initial = excluded.initial,
+                discount_percent = excluded.discount_percent, is_free = excluded.is_free, fetched_at = excluded.fetched_at
+        ''', rows)
+        # Fill in the app type for apps whose full details are already cached
+        conn.executemany('''
+            UPDATE price_catalog SET type = (SELECT json_extract(data, '$.type') FROM appdetails_cache WHERE appdetails_cache.appid = price_catalog.appid)
+            WHERE appid = ? AND cc = ? AND type IS NULL
+        ''', [(row[0], row[1]) for row in rows])
+        conn.commit()
+    finally:
+        conn.close()
 
-    if not owned_games_response or 'response' not in owned_games_response or 'games' not in owned_games_response['response']:
-        return jsonify({'error': 'Failed to fetch owned games or no games found.'}), 400
 
-    account_creation = player_summary['response']['players'][0].get('timecreated')
-    total_playtime_minutes = sum(game['playtime_forever'] for game in owned_games_response['response']['games'])
-    total_playtime_hours = total_playtime_minutes / 60
+def load_library_appids(conn, appids):
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS library_appids (appid INTEGER PRIMARY KEY)')
+    conn.execute('DELETE FROM library_appids')
+    conn.executemany('INSERT OR IGNORE INTO library_appids (appid) VALUES (?)', [(int(appid),) for appid in appids])
+    # The inserts opened a transaction, reads in it would pin a WAL snapshot and a later write
+    # in the same transaction fails with 'database is locked' (no busy wait) once another writer commits
+    conn.commit()
 
-    if account_creation:
-        weeks_since_creation = (time.time() - account_creation) / (60 * 60 * 24 * 7)
-        average_hours_per_week = total_playtime_hours / weeks_since_creation
-        return jsonify({'steamid': steamid, 'average_hours_per_week': average_hours_per_week})
-    else:
-        return jsonify({'error': 'Account creation date not available.'}), 400
 
+def stale_prices(appids, cc='us'):
+    conn = get_db()
+    try:
+        load_library_appids(conn, appids)
+        return [row[0] for row in conn.execute('''
+            SELECT l.appid FROM library_appids l
+            LEFT JOIN price_catalog p ON p.appid = l.appid AND p.cc = ?
+            WHERE p.appid IS NULL OR p.fetched_at < ?
+        ''', (cc, time.time() - APPDETAILS_TTL_PRICE))]
+    finally:
+        conn.close()
 
 
+#
+# Makes sure the catalog has a recent price for every appid, fetching only missing or stale ones
+# 'progress' is called with (apps done, apps total) as batches finish
+#
+def refresh_prices(appids, cc='us', progress=None):
+    total = len(set(appids))
+    stale = stale_prices(appids, cc)
+    metrics.record_cache('price_catalog', hits=total - len(stale), misses=len(stale))
+
+    done = total - len(stale)
+    if progress:
+        progress(done, total)
+    batches = [stale[i:i + PRICE_BATCH_SIZE] for i in range(0, len(stale), PRICE_BATCH_SIZE)]
+    for batch, rows, error in fan_out_as_completed(lambda batch: fetch_price_batch(batch, cc), batches, PRICE_MAX_WORKERS, STORE_HOST):
+        if error:
+            # Whatever price the catalog already has for these apps is used
+            mark_stale()
+            print(f"Error fetching prices for {len(batch)} apps: {error}")
+        else:
+            store_prices(rows)
+        done += len(batch)
+        if progress:
+            progress(done, total)
 
 
 #
-# Getting total library value 
-# Takes in url param steamid
+# Returns (total, currency) for the given games in the store currency of 'cc'
 #
-@app.route('/steam/api/library-value', methods=['GET'])
-def library_value():
-    steamid = request.args.get('steamid')
-    if not steamid:
-        return jsonify({'error': 'steamid parameter is required'}), 400
-    
-    owned_games_response = get_owned_games(steamid)
-    if not owned_games_response or 'response' not in owned_games_response or 'games' not in owned_games_response['response']:
-        return jsonify({'error': 'Failed to fetch owned games or no games found.'}), 400
+def compute_library_value(games, cc='us', progress=None):
+    appids = [game['appid'] for game in games]
+    refresh_prices(appids, cc, progress)
 
-    total_value = sum(get_game_price(game['appid']) for game in owned_games_response['response']['games'])
-    total_value_usd = "{:.2f}".format(total_value)
-    return jsonify({'steamid': steamid, 'total_library_value_usd': total_value_usd})
+    conn = get_db()
+    try:
+        load_library_appids(conn, appids)
+        total_cents, currency = conn.execute('''
+            SELECT SUM(p.final), MAX(p.currency) FROM library_appids l
+            JOIN price_catalog p ON p.appid = l.appid AND p.cc = ?
+            WHERE p.is_free = 0 AND (p.type IS NULL OR p.type = 'game')
+        ''', (cc,)).fetchone()
+    finally:
+        conn.close()
+    return (total_cents or 0) / 100.0, currency
 
 
 
 #
-# Endpoint for individual game info
-# Takes url param 'appid'
+# Genre index
+# Genres and categories of every app seen in any library, one app_genres row per (appid, kind, description),
+# kind being 'genres' or 'categories'. genre_index records when an appid was indexed,
+# apps Steam has no details for are indexed without rows.
+# Apps are indexed from appdetails_cache in one statement, only apps that were never fetched go to Steam:
+# up to GENRE_INDEX_FETCH_LIMIT per request (most played first), the next ones in the background,
+# with at most GENRE_INDEX_BACKGROUND_LIMIT apps queued at any time.
+# The background fill shares the store rate limit with interactive routes, so it has its own smaller budget
+# of GENRE_INDEX_BACKGROUND_RATE calls per second on top. Apps left over are picked up by later requests.
 #
-@app.route('/steam/api/game-details', methods=['GET'])
-def get_game_details():
-    appid = request.args.get('appid')
-    if not appid:
-        return jsonify({'error': 'AppID parameter is required'}), 400
+GENRE_INDEX_FETCH_LIMIT = int(os.getenv('GENRE_INDEX_FETCH_LIMIT', 20))
+GENRE_INDEX_BACKGROUND_LIMIT = int(os.getenv('GENRE_INDEX_BACKGROUND_LIMIT', 200))
+GENRE_INDEX_BACKGROUND_RATE = float(os.getenv('GENRE_INDEX_BACKGROUND_RATE', 0.2))
+GENRE_INDEX_MAX_WORKERS = 4
+GENRE_EXCLUDE_KEYWORDS = ('steam', 'support', 'controller')
+
+genre_index_executor = ContextThreadPoolExecutor(max_workers=2)
+genre_index_pending = set()
+genre_index_pending_lock = threading.Lock()
+genre_index_budget = steam_client.TokenBucket(GENRE_INDEX_BACKGROUND_RATE, 1)
+
+
+@functools.lru_cache(maxsize=4096)
+def is_excluded_genre(description):
+    description = description.lower()
+    return any(keyword in description for keyword in GENRE_EXCLUDE_KEYWORDS)
+
+
+def index_app_genres(conn, appids):
+    load_library_appids(conn, appids)
+    conn.execute('''
+        DELETE FROM app_genres WHERE appid IN (
+            SELECT l.appid FROM library_appids l JOIN appdetails_cache c ON c.appid = l.appid
+        )
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO app_genres (appid, kind, description)
+        SELECT c.appid, kind.name, json_extract(j.value, '$.description')
+        FROM library_appids l
+        JOIN appdetails_cache c ON c.appid = l.appid
+        CROSS JOIN (SELECT 'genres' AS name UNION ALL SELECT 'categories') kind
+        JOIN json_each(c.data, '$.' || kind.name) j
+        WHERE c.success = 1 AND json_extract(j.value, '$.description') IS NOT NULL
+    ''')
+    conn.execute('''
+        INSERT OR REPLACE INTO genre_index (appid, indexed_at)
+        SELECT c.appid, ? FROM library_appids l JOIN appdetails_cache c ON c.appid = l.appid
+    ''', (time.time(),))
+
+
+def fetch_app_genres(appids):
+    fetched = []
+    for appid, _, error in fan_out(lambda appid: get_app_details(appid, ('genres', 'categories')), appids, GENRE_INDEX_MAX_WORKERS, STORE_HOST):
+        if error:
+            print(f"Error fetching genres for {appid}: {error}")
+        else:
+            fetched.append(appid)
 
-    steam_url = f'http://store.steampowered.com/api/appdetails?appids={appid}'
-    response = requests.get(steam_url)
-    if response.status_code != 200:
-        return jsonify({'error': 'Failed to connect to the Steam API'}), response.status_code
+    conn = get_db()
+    try:
+        index_app_genres(conn, fetched)
+        conn.commit()
+    finally:
+        conn.close()
 
-    data = response.json()
-    if not data.get(appid, {}).get('success', False):
-        return jsonify({'error': 'Game details not found'}), 404
 
-    game_data = data[appid]['data']
+def fetch_app_genres_in_background(appids):
+    try:
+        # One app at a time, waiting for the budget outside of the store host slots
+        for appid in appids:
+            genre_index_budget.acquire()
+            fetch_app_genres([appid])
+    finally:
+        with genre_index_pending_lock:
+            genre_index_pending.difference_update(appids)
 
-    # Find the cheapest sub from 'default' package group
+
+#
+# Makes sure the apps of 'games' are in the genre index
+#
+def refresh_genre_index(games):
+    playtimes = {game['appid']: game.get('playtime_forever', 0) for game in games}
+    stale_query = '''
+        SELECT l.appid FROM library_appids l LEFT JOIN genre_index g ON g.appid = l.appid
+        WHERE g.appid IS NULL OR g.indexed_at < ?
+    '''
+    conn = get_db()
+    try:
+        load_library_appids(conn, playtimes)
+        stale = [appid for appid, in conn.execute(stale_query, (time.time() - APPDETAILS_TTL_STATIC,))]
+        if stale:
+            index_app_genres(conn, stale)
+            conn.commit()
+            # index_app_genres left the stale appids in library_appids, these have no appdetails yet
+            stale = [appid for appid, in conn.execute(stale_query, (time.time() - APPDETAILS_TTL_STATIC,))]
+    finally:
+        conn.close()
+    metrics.record_cache('genre_index', hits=len(playtimes) - len(stale), misses=len(stale))
+
+    stale.sort(key=lambda appid: playtimes[appid], reverse=True)
+    now, later = stale[:GENRE_INDEX_FETCH_LIMIT], stale[GENRE_INDEX_FETCH_LIMIT:]
+    if now:
+        fetch_app_genres(now)
+    with genre_index_pending_lock:
+        room = max(0, GENRE_INDEX_BACKGROUND_LIMIT - len(genre_index_pending))
+        later = [appid for appid in later if appid not in genre_index_pending][:room]
+        genre_index_pending.update(later)
+    if later:
+        genre_index_executor.submit(fetch_app_genres_in_background, later)
+
+
+#
+# Genre and category histograms of a whole library, weighted by playtime_forever
+# Shares are normalized per kind, 'coverage' is the share of playtime in apps that are indexed so far
+#
+def genre_profile(games):
+    refresh_genre_index(games)
+    conn = get_db()
+    try:
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS library_playtimes (appid INTEGER PRIMARY KEY, playtime INTEGER NOT NULL)')
+        conn.execute('DELETE FROM library_playtimes')
+        conn.executemany(
+            'INSERT OR REPLACE INTO library_playtimes (appid, playtime) VALUES (?, ?)',
+            [(game['appid'], game.get('playtime_forever', 0)) for game in games]
+        )
+        weights = conn.execute('''
+            SELECT a.kind, a.description, SUM(l.playtime) FROM library_playtimes l
+            JOIN app_genres a ON a.appid = l.appid
+            WHERE l.playtime > 0
+            GROUP BY a.kind, a.description
+        ''').fetchall()
+        total_playtime, indexed_playtime, indexed_games = conn.execute('''
+            SELECT SUM(l.playtime), SUM(CASE WHEN g.appid IS NULL THEN 0 ELSE l.playtime END), COUNT(g.appid)
+            FROM library_playtimes l LEFT JOIN genre_index g ON g.appid = l.appid
+        ''').fetchone()
+    finally:
+        conn.close()
+
+    profile = {
+        'mode': 'library',
+        'games_total': len(games),
+        'games_indexed': indexed_games,
+        'coverage': round(indexed_playtime / total_playtime, 4) if total_playtime else 0.0,
+    }
+    for kind in ('genres', 'categories'):
+        entries = [(description, playtime) for entry_kind, description, playtime in weights
+                   if entry_kind == kind and not is_excluded_genre(description)]
+        kind_total = sum(playtime for _, playtime in entries)
+        entries.sort(key=lambda entry: entry[1], reverse=True)
+        profile[kind] = [
+            {'name': description, 'playtime': playtime, 'share': round(playtime / kind_total, 4)}
+            for description, playtime in entries
+        ]
+    return profile
+
+
+
+#
+# Global achievement rarity index
+# Global achievement percentages are stored per appid in global_achievements,
+# achievement_index records when each appid was fetched and whether it has achievements at all,
+# so apps without achievements are skipped until ACHIEVEMENTS_NEGATIVE_TTL runs out.
+#
+ACHIEVEMENTS_TTL = int(os.getenv('ACHIEVEMENTS_TTL', 24 * 60 * 60))
+ACHIEVEMENTS_NEGATIVE_TTL = int(os.getenv('ACHIEVEMENTS_NEGATIVE_TTL', 7 * 24 * 60 * 60))
+ACHIEVEMENTS_MAX_WORKERS = 16
+SQLITE_MAX_PARAMS = 500
+
+
+def fetch_global_achievement_percentages(appid):
+    url = f'http://api.steampowered.com/ISteamUserStats/GetGlobalAchievementPercentagesForApp/v0002/?gameid={appid}&format=json'
+    response = steam_client.get(url)
+    # Steam answers 4xx for apps without stats, anything else is worth retrying later
+    if response.status_code == 429 or response.status_code >= 500:
+        response.raise_for_status()
+    try:
+        data = response.json() or {}
+    except ValueError:
+        return []
+    return data.get('achievementpercentages', {}).get('achievements', [])
+
+
+def refresh_global_achievements(appid):
+    achievements = fetch_global_achievement_percentages(appid)
+    conn = get_db()
+    try:
+        conn.execute('DELETE FROM global_achievements WHERE appid = ?', (appid,))
+        conn.executemany(
+            'INSERT OR REPLACE INTO global_achievements (appid, apiname, percent) VALUES (?, ?, ?)',
+            [(appid, ach['name'], float(ach['percent'])) for ach in achievements]
+        )
+        conn.execute(
+            'INSERT OR REPLACE INTO achievement_index (appid, has_achievements, fetched_at) VALUES (?, ?, ?)',
+            (appid, 1 if achievements else 0, time.time())
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+#
+# Returns {appid: {apiname: percent}} for the given appids that have achievements
+# Missing or expired appids are fetched from Steam concurrently first
+#
+def get_global_achievement_rarity(appids):
+    appids = list(dict.fromkeys(int(appid) for appid in appids))
+    chunks = [appids[i:i + SQLITE_MAX_PARAMS] for i in range(0, len(appids), SQLITE_MAX_PARAMS)]
+
+    def load_index():
+        index = {}
+        conn = get_db()
+        try:
+            for chunk in chunks:
+                placeholders = ','.join('?' * len(chunk))
+                rows = conn.execute(f'SELECT appid, has_achievements, fetched_at FROM achievement_index WHERE appid IN ({placeholders})', chunk)
+                index.update({appid: (has_achievements, fetched_at) for appid, has_achievements, fetched_at in rows})
+        finally:
+            conn.close()
+        return index
+
+    index = load_index()
+    now = time.time()
+    expired = [
+        appid for appid in appids
+        if appid not in index
+        or now - index[appid][1] > (ACHIEVEMENTS_TTL if index[appid][0] else ACHIEVEMENTS_NEGATIVE_TTL)
+    ]
+    metrics.record_cache('achievement_index', hits=len(appids) - len(expired), misses=len(expired))
+
+    if expired:
+        for appid, _, error in fan_out(refresh_global_achievements, expired, ACHIEVEMENTS_MAX_WORKERS, API_HOST):
+            if error:
+                if appid in index:
+                    mark_stale()
+                print(f"Error fetching global achievements for {appid}: {error}")
+        index = load_index()
+
+    with_achievements = [appid for appid in appids if index.get(appid, (0,))[0]]
+    rarity = {}
+    conn = get_db()
+    try:
+        for i in range(0, len(with_achievements), SQLITE_MAX_PARAMS):
+            chunk = with_achievements[i:i + SQLITE_MAX_PARAMS]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(f'SELECT appid, apiname, percent FROM global_achievements WHERE appid IN ({placeholders})', chunk)
+            for appid, apiname, percent in rows:
+                rarity.setdefault(appid, {})[apiname] = percent
+    finally:
+        conn.close()
+    return rarity
+
+
+
+#
+# Getting Most Rare Acheivements
+# Uses the rarity index above, then only asks for player achievements
+# in games that have achievements and have actually been played
+# Answers 202 with a job id when that would take too long, see Jobs below
+#
+@app.route('/steam/api/rare-achievements', methods=['GET'])
+def rare_achievements():
+    steamid = request.args.get('steamid')
+    owned_games_response = get_owned_games(steamid, fresh=wants_fresh())
+    
+    if not owned_games_response or 'response' not in owned_games_response or 'games' not in owned_games_response['response']:
+        return jsonify({'error': 'Failed to fetch owned games or no games found.'}), 400
+
+    games = owned_games_response['response']['games']
+    if not wants_sync() and estimate_rare_achievements_seconds(games) > JOB_ASYNC_SECONDS:
+        return job_accepted('rare_achievements', steamid)
+
+    return jsonify(find_rare_achievements(steamid, games))
+
+
+#
+# 'progress' is called with (played games done, played games total)
+#
+def find_rare_achievements(steamid, games, progress=None):
+    played_games = [game for game in games if game.get('playtime_forever', 0) > 0]
+    rarity = get_global_achievement_rarity(game['appid'] for game in played_games)
+    games_with_achievements = [game for game in played_games if game['appid'] in rarity]
+    done = len(played_games) - len(games_with_achievements)
+    if progress:
+        progress(done, len(played_games))
+
+    def player_rare_achievements(game):
+        player_achievements_response = get_player_achievements(game['appid'], steamid)
+        global_ach_dict = rarity[game['appid']]
+        return [
+            {
+                'game': game['name'],
+                'achievement': player_achievement['apiname'],
+                'rarity': global_ach_dict[player_achievement['apiname']]
+            }
+            for player_achievement in player_achievements_response.get('playerstats', {}).get('achievements', [])
+            if player_achievement.get('achieved') == 1 and player_achievement['apiname'] in global_ach_dict
+        ]
+
+    def all_rare_achievements():
+        outcomes = fan_out_as_completed(player_rare_achievements, games_with_achievements, ACHIEVEMENTS_MAX_WORKERS, API_HOST)
+        for i, (game, achievements, error) in enumerate(outcomes):
+            if error:
+                print(f"Error fetching player achievements for {game['appid']}: {error}")
+            else:
+                yield from achievements
+            if progress:
+                progress(done + i + 1, len(played_games))
+
+    # Bounded heap keeps only the 10 rarest achievements instead of sorting all of them
+    rarest = heapq.nsmallest(10, all_rare_achievements(), key=lambda x: x['rarity'])
+    record_leaderboard_scores(steamid, {'rarest_achievement': (rarest[0]['rarity'], rarest[0]) if rarest else None})
+    return rarest
+
+
+
+#
+# Getting total hours
+# Takes in url param 'steamid'
+#
+@app.route('/steam/api/total-hours', methods=['GET'])
+def total_hours():
+    steamid = request.args.get('steamid')
+    if not steamid:
+        return jsonify({'error': 'steamid parameter is required'}), 400
+    
+    owned_games_response = get_owned_games(steamid, fresh=wants_fresh())
+    
+    if not owned_games_response or 'response' not in owned_games_response or 'games' not in owned_games_response['response']:
+        return jsonify({'error': 'Failed to fetch owned games or no games found.'}), 400
+
+    total_playtime_minutes = sum(game['playtime_forever'] for game in owned_games_response['response']['games'])
+    total_playtime_hours = total_playtime_minutes / 60  # Convert minutes to hours
+    total_playtime_hours_rounded = floor(total_playtime_hours)  # Round down to the nearest whole number
+    
+    return jsonify({'steamid': steamid, 'total_hours_played': total_playtime_hours_rounded})
+
+
+
+#
+# Average hours per week
+# takes in param 'steamid'
+#
+@app.route('/steam/api/average-hours-per-week', methods=['GET'])
+def average_hours_per_week():
+    steamid = request.args.get('steamid')
+    if not steamid:
+        return jsonify({'error': 'steamid parameter is required'}), 400
+
+    player_summary = get_player_summaries(steamid, fresh=wants_fresh())
+    owned_games_response = get_owned_games(steamid, fresh=wants_fresh())
+
+    if 'response' not in player_summary or 'players' not in player_summary['response'] or len(player_summary['response']['players']) == 0:
+        return jsonify({'error': 'Failed to fetch player summary.'}), 400
+
+    if not owned_games_response or 'response' not in owned_games_response or 'games' not in owned_games_response['response']:
+        return jsonify({'error': 'Failed to fetch owned games or no games found.'}), 400
+
+    account_creation = player_summary['response']['players'][0].get('timecreated')
+    total_playtime_minutes = sum(game['playtime_forever'] for game in owned_games_response['response']['games'])
+    total_playtime_hours = total_playtime_minutes / 60
+
+    if account_creation:
+        average_hours_per_week = total_playtime_hours / weeks_since(account_creation)
+        return jsonify({'steamid': steamid, 'average_hours_per_week': average_hours_per_week})
+    else:
+        return jsonify({'error': 'Account creation date not available.'}), 400
+
+
+def weeks_since(timestamp):
+    return (time.time() - timestamp) / (60 * 60 * 24 * 7)
+
+
+
+
+
+#
+# Getting total library value 
+# Takes in url param steamid
+# Optional url param 'cc' picks the store country (and currency), defaults to 'us'
+# Answers 202 with a job id when the missing prices would take too long to fetch, see Jobs below
+#
+@app.route('/steam/api/library-value', methods=['GET'])
+def library_value():
+    steamid = request.args.get('steamid')
+    if not steamid:
+        return jsonify({'error': 'steamid parameter is required'}), 400
+    
+    owned_games_response = get_owned_games(steamid, fresh=wants_fresh())
+    if not owned_games_response or 'response' not in owned_games_response or 'games' not in owned_games_response['response']:
+        return jsonify({'error': 'Failed to fetch owned games or no games found.'}), 400
+
+    cc = request.args.get('cc', 'us').lower()
+    if len(cc) != 2 or not cc.isalpha():
+        return jsonify({'error': 'cc must be a two letter country code'}), 400
+
+    games = owned_games_response['response']['games']
+    if not wants_sync() and estimate_library_value_seconds(games, cc) > JOB_ASYNC_SECONDS:
+        return job_accepted('library_value', steamid, {'cc': cc})
+
+    return jsonify(library_value_payload(steamid, games, cc))
+
+
+def library_value_payload(steamid, games, cc, progress=None):
+    total_value, currency = compute_library_value(games, cc, progress)
+    if cc == 'us':
+        record_leaderboard_scores(steamid, {'library_value': (round(total_value, 2), {'currency': currency})})
+    total_value = "{:.2f}".format(total_value)
+
+    value = {'steamid': steamid, 'cc': cc, 'currency': currency, 'total_library_value': total_value}
+    if cc == 'us':
+        value['total_library_value_usd'] = total_value
+    return value
+
+
+
+#
+# Jobs
+# library_value and rare_achievements can take minutes on big libraries. When the Steam calls they still need
+# would take longer than JOB_ASYNC_SECONDS under the rate limits, the routes answer 202 with a job id instead,
+# unless called with 'sync=1'. Progress and results are polled from GET /jobs/<id>.
+#
+JOB_ASYNC_SECONDS = float(os.getenv('JOB_ASYNC_SECONDS', 20))
+
+job_runner = jobs.JobRunner(get_db)
+
+
+def wants_sync():
+    return request.args.get('sync') == '1'
+
+
+def estimated_steam_seconds(host, calls):
+    rate, burst = steam_client.STEAM_RATE_LIMITS[host]
+    return max(0, calls - burst) / rate
+
+
+def estimate_library_value_seconds(games, cc):
+    batches = -(-len(stale_prices([game['appid'] for game in games], cc)) // PRICE_BATCH_SIZE)
+    return estimated_steam_seconds('store.steampowered.com', batches)
+
+
+def estimate_rare_achievements_seconds(games):
+    conn = get_db()
+    try:
+        load_library_appids(conn, [game['appid'] for game in games if game.get('playtime_forever', 0) > 0])
+        # Unknown apps may need both the global percentages and the player's achievements
+        expired, player_calls = conn.execute('''
+            SELECT
+                SUM(a.appid IS NULL OR a.fetched_at < ? - CASE WHEN a.has_achievements THEN ? ELSE ? END),
+                SUM(COALESCE(a.has_achievements, 1))
+            FROM library_appids l LEFT JOIN achievement_index a ON a.appid = l.appid
+        ''', (time.time(), ACHIEVEMENTS_TTL, ACHIEVEMENTS_NEGATIVE_TTL)).fetchone()
+    finally:
+        conn.close()
+    return estimated_steam_seconds('api.steampowered.com', (expired or 0) + (player_calls or 0))
+
+
+def start_job(job_type, steamid, params=None):
+    job_id, created = job_runner.submit(job_type, steamid, params)
+    return {'job_id': job_id, 'type': job_type, 'created': created, 'status_url': f'/jobs/{job_id}'}
+
+
+def job_accepted(job_type, steamid, params=None):
+    job = start_job(job_type, steamid, params)
+    response = jsonify(job)
+    response.status_code = 202
+    response.headers['Location'] = job['status_url']
+    return response
+
+
+def owned_games_for_job(steamid):
+    games = get_owned_games(steamid).get('response', {}).get('games')
+    if games is None:
+        raise ValueError('Failed to fetch owned games or no games found.')
+    return games
+
+
+@job_runner.handler('library_value')
+def library_value_job(steamid, progress, cc='us'):
+    return library_value_payload(steamid, owned_games_for_job(steamid), cc, progress)
+
+
+@job_runner.handler('rare_achievements')
+def rare_achievements_job(steamid, progress):
+    return find_rare_achievements(steamid, owned_games_for_job(steamid), progress)
+
+
+#
+# Starts a job, takes a JSON body {"type": "library_value" | "rare_achievements", "steamid": ..., "params": {...}}
+# Answers 202 with the job id, an equivalent job that is still running or recently done is reused
+#
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not body.get('type') or not str(body.get('steamid', '')).isdigit():
+        return jsonify({'error': 'Expected a JSON object with "type" and a numeric "steamid"'}), 400
+    if not isinstance(body['type'], str) or body['type'] not in job_runner.handlers:
+        return jsonify({'error': f"Unknown job type, expected one of {sorted(job_runner.handlers)}"}), 400
+
+    params = body.get('params') or {}
+    if not isinstance(params, dict):
+        return jsonify({'error': '"params" must be a JSON object'}), 400
+    if body['type'] == 'library_value':
+        params = {'cc': str(params.get('cc', 'us')).lower()}
+        if len(params['cc']) != 2 or not params['cc'].isalpha():
+            return jsonify({'error': 'cc must be a two letter country code'}), 400
+    else:
+        params = {}
+    return job_accepted(body['type'], str(body['steamid']), params)
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_runner.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+
+
+#
+# HTTP response cache for the store data routes
+# Responses are cached per route and normalized query args for RESPONSE_CACHE_TTL seconds,
+# served with a strong ETag, Cache-Control and Last-Modified, and If-None-Match gets a 304.
+# Large bodies are gzip/brotli compressed once per cached entry, not on every hit.
+# Snapshots published by the store feed prefetcher (see below) take precedence over the cache.
+# Views mark incomplete responses Cache-Control: no-store, those are passed through and never cached.
+#
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 5 * 60))
+RESPONSE_COMPRESS_MIN_SIZE = 1024
+RESPONSE_CACHE_IGNORED_ARGS = ('fresh', 'profile')
+
+response_cache = LRUCache(maxsize=int(os.getenv('RESPONSE_CACHE_SIZE', 512)))
+
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body)
+    return gzip.compress(body, compresslevel=6)
+
+
+def serve_cached_response(entry, ttl):
+    encodings = ['br', 'gzip'] if brotli else ['gzip']
+    encoding = request.accept_encodings.best_match(encodings) if len(entry['body']) >= RESPONSE_COMPRESS_MIN_SIZE else None
+
+    # Each encoding is its own representation, so it gets its own strong ETag
+    etag = f"{entry['etag']}-{encoding}" if encoding else entry['etag']
+    if any(request.if_none_match.contains(tag) for tag in [entry['etag']] + [f"{entry['etag']}-{name}" for name in encodings]):
+        response = Response(status=304)
+    else:
+        if encoding:
+            if encoding not in entry['encoded']:
+                entry['encoded'][encoding] = compress_body(entry['body'], encoding)
+            response = Response(entry['encoded'][encoding], mimetype=entry['mimetype'])
+            response.headers['Content-Encoding'] = encoding
+        else:
+            response = Response(entry['body'], mimetype=entry['mimetype'])
+
+    response.set_etag(etag)
+    response.last_modified = entry['last_modified']
+    response.cache_control.public = True
+    response.cache_control.max_age = ttl
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def cache_entry(body, mimetype, previous=None):
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    unchanged = previous is not None and previous['etag'] == etag
+    return {
+        'body': body,
+        'mimetype': mimetype,
+        'etag': etag,
+        'last_modified': previous['last_modified'] if unchanged else datetime.now(timezone.utc).replace(microsecond=0),
+        'created': time.time(),
+        'encoded': dict(previous['encoded']) if unchanged else {},
+    }
+
+
+def cached_response(ttl=RESPONSE_CACHE_TTL):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if wants_fresh() or request.args.get('stream') == '1':
+                return view(*args, **kwargs)
+
+            key = (request.path, tuple(sorted(
+                (name, value) for name, value in request.args.items(multi=True) if name not in RESPONSE_CACHE_IGNORED_ARGS
+            )))
+            snapshot = store_snapshots.get(key)
+            if snapshot is not None:
+                metrics.record_cache('store_snapshot', hits=1)
+                # The prefetcher stopped keeping up
+                if STORE_PREFETCH_INTERVAL and time.time() - snapshot['created'] > 3 * STORE_PREFETCH_INTERVAL:
+                    mark_stale()
+                return serve_cached_response(snapshot, ttl)
+
+            entry = response_cache.get(key)
+            if entry is None or time.time() - entry['created'] > ttl:
+                try:
+                    response = app.make_response(view(*args, **kwargs))
+                except requests.RequestException:
+                    if entry is None:
+                        raise
+                    response = None
+                if (response is None or response.status_code >= 500) and entry is not None:
+                    # Steam is failing, the last response is better than an error
+                    mark_stale()
+                    metrics.record_cache('response', hits=1)
+                    return Response(entry['body'], mimetype=entry['mimetype'])
+                if response.status_code != 200 or response.is_streamed or g.get('stale') or response.cache_control.no_store:
+                    return response
+
+                entry = cache_entry(response.get_data(), response.mimetype, entry)
+                response_cache.set(key, entry)
+                metrics.record_cache('response', misses=1)
+            else:
+                metrics.record_cache('response', hits=1)
+
+            return serve_cached_response(entry, ttl)
+        return wrapper
+    return decorator
+
+
+
+#
+# Endpoint for individual game info
+# Takes url param 'appid'
+#
+@app.route('/steam/api/game-details', methods=['GET'])
+@cached_response()
+def get_game_details():
+    appid = request.args.get('appid')
+    if not appid:
+        return jsonify({'error': 'AppID parameter is required'}), 400
+
+    try:
+        game_data = get_app_details(appid)
+    except steam_client.SteamUnavailable:
+        raise
+    except requests.RequestException as e:
+        status_code = e.response.status_code if e.response is not None else 502
+        return jsonify({'error': 'Failed to connect to the Steam API'}), status_code
+    except ValueError:
+        return jsonify({'error': 'AppID must be numeric'}), 400
+
+    if not game_data:
+        return jsonify({'error': 'Game details not found'}), 404
+
+    return jsonify(build_game_details(game_data)), 200  # Successful response with game details
+
+
+#
+# Turns appdetails 'data' into the game details returned by the routes
+#
+def build_game_details(game_data):
+    # Find the cheapest sub from 'default' package group
     default_package_group = next((group for group in game_data.get('package_groups', []) if group['name'] == 'default'), None)
     cheapest_sub = None
     if default_package_group:
         subs = default_package_group.get('subs', [])
         if subs:
-            # Find the sub with the lowest price
-            cheapest_sub = min(subs, key=lambda x: x['price_in_cents_with_discount'])
+            # Find the sub with the lowest price (copied, the cached details must not be modified)
+            cheapest_sub = dict(min(subs, key=lambda x: x['price_in_cents_with_discount']))
             # Convert price from cents to dollars
             cheapest_sub['price_in_dollars'] = cheapest_sub['price_in_cents_with_discount'] / 100.0
 
@@ -498,7 +1598,7 @@ def get_game_details():
         'base_price': base_price
     }
 
-    return jsonify(details), 200  # Successful response with game details
+    return details
 
 
 
@@ -510,61 +1610,1300 @@ def get_game_details():
 # Featured Games (Windows only)
 #
 @app.route('/steam/api/featured-games/', methods=['GET'])
+@cached_response()
 def get_featured_games():
+    return jsonify(fetch_featured_games())
+
+
+def fetch_featured_games():
     url = 'http://store.steampowered.com/api/featured'
-    response = requests.get(url)
+    response = steam_client.get(url)
     data = response.json()
-    
-    featured_win = data.get('featured_win', [])
-    return jsonify(featured_win)
+
+    return data.get('featured_win', [])
 
 
 
 #
 # Getting apps for genre 
 # takes in url param 'genre'
+# Optional url param 'stream=1' returns NDJSON, one game per line as soon as its details arrive
+# When some details couldn't be fetched within GENRE_DETAILS_TIMEOUT the list is partial:
+# X-Apps-Missing gives how many apps are left out, and the response isn't cached
 #
+GENRE_DETAILS_MAX_WORKERS = 8
+GENRE_DETAILS_TIMEOUT = float(os.getenv('GENRE_DETAILS_TIMEOUT', 30))
+
+
 @app.route('/steam/api/apps-in-genre', methods=['GET'])
+@cached_response()
 def get_apps_in_genre():
     genre = request.args.get('genre')
     if not genre:
         return jsonify({'error': 'Genre parameter is required'}), 400
 
+    try:
+        app_ids = fetch_genre_app_ids(genre)
+    except requests.HTTPError as e:
+        return jsonify({'error': 'Failed to fetch data'}), e.response.status_code
+
+    # Apps listed in several tabs are only fetched once
+    unique_app_ids = list(dict.fromkeys(app_ids))
+
+    if request.args.get('stream') == '1':
+        return Response(stream_with_context(stream_game_details(unique_app_ids)), mimetype='application/x-ndjson')
+
+    outcomes = fan_out(get_game_details_for_app, unique_app_ids, GENRE_DETAILS_MAX_WORKERS, STORE_HOST, GENRE_DETAILS_TIMEOUT)
+    details_by_app = {app_id: details for app_id, details, _ in outcomes}
+    missing = sum(1 for outcome in outcomes if outcome.error is not None)
+
+    full_game_details = [details_by_app[app_id] for app_id in app_ids if details_by_app[app_id]]
+    response = jsonify(full_game_details)
+    if missing:
+        response.headers['X-Apps-Missing'] = str(missing)
+        response.cache_control.no_store = True
+    return response
+
+
+def fetch_genre_app_ids(genre):
     # Fetching genre-specific game IDs
     url = f'http://store.steampowered.com/api/getappsingenre?genre={genre}'
-    response = requests.get(url)
-    if response.status_code != 200:
-        return jsonify({'error': 'Failed to fetch data'}), response.status_code
+    response = steam_client.get(url)
+    response.raise_for_status()
 
     data = response.json()
-    full_game_details = []
 
     # Iterate through tabs like 'featured', 'newreleases', etc.
-    for tab_name, tab_content in data.get('tabs', {}).items():
-        # Process each game in the tab
-        for item in tab_content.get('items', []):
-            app_id = item.get('id')
-            if app_id:
-                # Call local function to fetch details from '/steam/api/game-details'
-                game_details = get_game_details_locally(app_id)
-                if game_details:
-                    full_game_details.append(game_details)
+    return [
+        item.get('id')
+        for tab_content in data.get('tabs', {}).values()
+        for item in tab_content.get('items', [])
+        if item.get('id')
+    ]
 
-    return jsonify(full_game_details)
+
+def stream_game_details(app_ids):
+    # Closing the outcomes stops fetching if the client went away
+    with contextlib.closing(fan_out_as_completed(get_game_details_for_app, app_ids, GENRE_DETAILS_MAX_WORKERS, STORE_HOST)) as outcomes:
+        for _, game_details, _ in outcomes:
+            if game_details:
+                yield app.json.dumps(game_details) + '\n'
 
 
 #
-# Get game details locally
+# Get game details for an app without going through the route
+# Returns None if Steam has no details or can't be reached, SteamUnavailable is raised so callers can tell
 #
-def get_game_details_locally(app_id):
-    with app.test_request_context(f'?appid={app_id}'):
-        response, status_code = get_game_details()
-        if status_code == 200:
-            return response.get_json()  # Extract the JSON data from the response object
-        else:
+def get_game_details_for_app(app_id):
+    try:
+        game_data = get_app_details(app_id)
+    except steam_client.SteamUnavailable:
+        raise
+    except requests.RequestException as e:
+        print(f"Error fetching details for {app_id}: {e}")
+        return None
+    return build_game_details(game_data) if game_data else None
+
+
+
+
+#
+# Store feed prefetcher
+# The featured list and the genre tabs are the same for every user, so a background thread refreshes them
+# every STORE_PREFETCH_INTERVAL seconds (0 disables it) for the genres in STORE_PREFETCH_GENRES.
+# Each run only fetches details for apps the previous run hadn't seen (or whose details are older than
+# APPDETAILS_TTL_PRICE), then publishes every feed as an immutable snapshot: the serialized body, its ETag
+# and compressed variants. cached_response() serves snapshots before anything else, without upstream calls.
+#
+STORE_PREFETCH_INTERVAL = int(os.getenv('STORE_PREFETCH_INTERVAL', 0))
+STORE_PREFETCH_GENRES = [
+    genre.strip()
+    for genre in os.getenv('STORE_PREFETCH_GENRES', 'Action,Adventure,Casual,Indie,RPG,Simulation,Strategy,Sports,Racing').split(',')
+    if genre.strip()
+]
+
+# Snapshots are replaced, never modified, so readers need no lock
+store_snapshots = {}
+prefetched_details = {}  # appid -> (game details or None, fetched_at), only touched by the prefetcher thread
+
+
+def publish_store_snapshot(path, args, data):
+    key = (path, tuple(sorted(args.items())))
+    response = app.json.response(data)
+    entry = cache_entry(response.get_data(), response.mimetype, store_snapshots.get(key))
+    if len(entry['body']) >= RESPONSE_COMPRESS_MIN_SIZE:
+        for encoding in (['br', 'gzip'] if brotli else ['gzip']):
+            entry['encoded'].setdefault(encoding, compress_body(entry['body'], encoding))
+    store_snapshots[key] = entry
+
+
+def prefetch_store_feeds():
+    with app.app_context():
+        try:
+            publish_store_snapshot('/steam/api/featured-games/', {}, fetch_featured_games())
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error prefetching featured games: {e}")
+
+        seen = set()
+        for genre in STORE_PREFETCH_GENRES:
+            try:
+                app_ids = fetch_genre_app_ids(genre)
+            except (requests.RequestException, ValueError) as e:
+                # The previous snapshot of this genre stays up
+                print(f"Error prefetching genre {genre}: {e}")
+                continue
+
+            unique_app_ids = list(dict.fromkeys(app_ids))
+            seen.update(unique_app_ids)
+            new_app_ids = [
+                app_id for app_id in unique_app_ids
+                if app_id not in prefetched_details or time.time() - prefetched_details[app_id][1] > APPDETAILS_TTL_PRICE
+            ]
+            failed = 0
+            for app_id, details, error in fan_out(get_game_details_for_app, new_app_ids, GENRE_DETAILS_MAX_WORKERS, STORE_HOST):
+                if error is None:
+                    prefetched_details[app_id] = (details, time.time())
+                elif app_id not in prefetched_details:
+                    failed += 1
+            if failed:
+                # Older details are fine to reuse, but a genre missing apps keeps its previous snapshot
+                print(f"Error prefetching genre {genre}: {failed} apps unavailable")
+                continue
+
+            full_game_details = [prefetched_details[app_id][0] for app_id in app_ids if prefetched_details[app_id][0]]
+            publish_store_snapshot('/steam/api/apps-in-genre', {'genre': genre}, full_game_details)
+            print(f"Prefetched genre {genre}: {len(unique_app_ids)} apps, {len(new_app_ids)} fetched")
+
+        for app_id in set(prefetched_details) - seen:
+            del prefetched_details[app_id]
+
+
+def run_store_prefetcher(interval):
+    while True:
+        try:
+            if take_lease('store-prefetch', BACKGROUND_LEASE_RUNS * interval):
+                prefetch_store_feeds()
+        except Exception as e:
+            print(f"Store prefetch run failed: {e}")
+        time.sleep(interval)
+
+
+def start_store_prefetcher():
+    if STORE_PREFETCH_INTERVAL > 0:
+        threading.Thread(target=run_store_prefetcher, args=(STORE_PREFETCH_INTERVAL,), name='store-prefetch', daemon=True).start()
+
+
+
+
+#
+# Background ingestion
+# Snapshots owned games, player summaries and friend lists of every registered user
+# into local tables, so the analytics routes don't have to go to Steam on every hit.
+# Runs in-process every INGESTION_INTERVAL seconds (0 disables it), or from the cli:
+#   flask --app app ingest [--loop]
+# Routes use a snapshot while it is younger than INGESTION_MAX_AGE, '?fresh=1' skips it.
+#
+INGESTION_INTERVAL = int(os.getenv('INGESTION_INTERVAL', 0))
+INGESTION_MAX_AGE = int(os.getenv('INGESTION_MAX_AGE', 6 * 60 * 60))
+INGESTION_MAX_WORKERS = 8
+
+
+def wants_fresh():
+    return request.args.get('fresh') == '1'
+
+
+def snapshot_is_recent(conn, steamid, column, max_age=INGESTION_MAX_AGE):
+    row = conn.execute(f'SELECT {column} FROM ingestion_state WHERE steamid = ?', (str(steamid),)).fetchone()
+    return bool(row and row[0] and time.time() - row[0] < max_age)
+
+
+def load_local_owned_games(steamid, max_age=INGESTION_MAX_AGE):
+    conn = get_db()
+    try:
+        if not snapshot_is_recent(conn, steamid, 'owned_games_at', max_age):
             return None
-        
+        rows = conn.execute('''
+            SELECT appid, name, img_icon_url, playtime_forever, playtime_2weeks, rtime_last_played
+            FROM owned_games WHERE steamid = ?
+        ''', (str(steamid),)).fetchall()
+    finally:
+        conn.close()
+
+    games = []
+    for appid, name, img_icon_url, playtime_forever, playtime_2weeks, rtime_last_played in rows:
+        game = {
+            'appid': appid,
+            'name': name,
+            'img_icon_url': img_icon_url,
+            'playtime_forever': playtime_forever,
+            'rtime_last_played': rtime_last_played
+        }
+        if playtime_2weeks:
+            game['playtime_2weeks'] = playtime_2weeks
+        games.append(game)
+    return {'response': {'game_count': len(games), 'games': games}}
+
+
+#
+# Player summaries in input order, from the player_summaries table when recent,
+# the rest through get_player_summaries_batch
+#
+def load_player_summaries(steam_ids, max_age=INGESTION_MAX_AGE):
+    summaries = {}
+    unique_ids = list(dict.fromkeys(steam_ids))
+    conn = get_db()
+    try:
+        for i in range(0, len(unique_ids), SQLITE_MAX_PARAMS):
+            chunk = unique_ids[i:i + SQLITE_MAX_PARAMS]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f'SELECT steamid, data FROM player_summaries WHERE steamid IN ({placeholders}) AND fetched_at > ?',
+                chunk + [time.time() - max_age]
+            )
+            summaries.update({steamid: json.loads(data) for steamid, data in rows})
+    finally:
+        conn.close()
+    return summaries
+
+
+def resolve_player_summaries(steam_ids, fresh=False):
+    steam_ids = [str(steam_id) for steam_id in steam_ids]
+    local = {} if fresh else load_player_summaries(steam_ids)
+
+    missing = list(dict.fromkeys(steam_id for steam_id in steam_ids if steam_id not in local))
+    if not fresh:
+        metrics.record_cache('player_summaries', hits=len(steam_ids) - len(missing), misses=len(missing))
+    fetched = dict(zip(missing, get_player_summaries_batch(missing)))
+    store_player_summaries(fetched.values())
+
+    failed = [steam_id for steam_id, player in fetched.items() if 'error' in player]
+    if failed:
+        stale = load_player_summaries(failed, max_age=float('inf'))
+        if stale:
+            mark_stale()
+            fetched.update(stale)
+    return [local[steam_id] if steam_id in local else fetched[steam_id] for steam_id in steam_ids]
+
+
+def set_ingestion_state(conn, steamid, column, timestamp):
+    conn.execute(f'''
+        INSERT INTO ingestion_state (steamid, {column}) VALUES (?, ?)
+        ON CONFLICT(steamid) DO UPDATE SET {column} = excluded.{column}
+    ''', (steamid, timestamp))
+
+
+def store_player_summaries(players):
+    now = time.time()
+    conn = get_db()
+    try:
+        conn.executemany('''
+            INSERT OR REPLACE INTO player_summaries (steamid, personaname, avatarmedium, timecreated, data, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [
+            (player['steamid'], player.get('personaname'), player.get('avatarmedium'), player.get('timecreated'), json.dumps(player), now)
+            for player in players if 'error' not in player
+        ])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def store_friend_list(steamid, friends):
+    conn = get_db()
+    try:
+        conn.execute('DELETE FROM friend_edges WHERE steamid = ?', (steamid,))
+        conn.executemany(
+            'INSERT OR REPLACE INTO friend_edges (steamid, friend_steamid, relationship, friend_since) VALUES (?, ?, ?, ?)',
+            [(steamid, friend['steamid'], friend.get('relationship'), friend.get('friend_since')) for friend in friends]
+        )
+        set_ingestion_state(conn, steamid, 'friends_at', time.time())
+        conn.commit()
+    finally:
+        conn.close()
+
+
+#
+# Stores a fresh owned games payload for a user
+# Only rows whose playtime or rtime_last_played changed are rewritten,
+# returns the appids that changed (new games included). The packed copy in library_index is always rewritten.
+# write_owned_games does the same inside the caller's transaction.
+# For registered users, new playtime_forever values are appended to playtime_snapshots (see Playtime history)
+# and the total_hours and most_played leaderboard entries are updated.
+#
+def store_owned_games(steamid, games):
+    conn = get_db()
+    try:
+        changed = write_owned_games(conn, steamid, games, time.time())
+        conn.commit()
+    finally:
+        conn.close()
+    return changed
+
+
+def write_owned_games(conn, steamid, games, now):
+    existing = {
+        appid: (playtime_forever, playtime_2weeks, rtime_last_played)
+        for appid, playtime_forever, playtime_2weeks, rtime_last_played in conn.execute(
+            'SELECT appid, playtime_forever, playtime_2weeks, rtime_last_played FROM owned_games WHERE steamid = ?', (steamid,)
+        )
+    }
+
+    changed_rows = []
+    snapshot_rows = []
+    for game in games:
+        state = (game.get('playtime_forever', 0), game.get('playtime_2weeks', 0), game.get('rtime_last_played', 0))
+        previous = existing.pop(game['appid'], None)
+        if previous != state:
+            changed_rows.append((steamid, game['appid'], game.get('name'), game.get('img_icon_url')) + state + (now,))
+            if previous is None or previous[0] != state[0]:
+                snapshot_rows.append((steamid, game['appid'], now, state[0]))
+
+    conn.executemany('''
+        INSERT OR REPLACE INTO owned_games
+            (steamid, appid, name, img_icon_url, playtime_forever, playtime_2weeks, rtime_last_played, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', changed_rows)
+    # Whatever is left in existing is no longer in the library
+    conn.executemany('DELETE FROM owned_games WHERE steamid = ? AND appid = ?', [(steamid, appid) for appid in existing])
+    write_library(conn, steamid, games, now)
+    # Friends pulled in by get_libraries get no history, nothing reads it
+    if conn.execute('SELECT 1 FROM users WHERE steam_id = ?', (steamid,)).fetchone():
+        if not conn.execute('SELECT 1 FROM snapshot_runs WHERE steamid = ? LIMIT 1', (steamid,)).fetchone():
+            # First snapshot since registering, unchanged games need a starting point too
+            snapshot_rows = [(steamid, game['appid'], now, game.get('playtime_forever', 0)) for game in games]
+        conn.executemany(
+            'INSERT OR IGNORE INTO playtime_snapshots (steamid, appid, taken_at, playtime_forever) VALUES (?, ?, ?, ?)', snapshot_rows
+        )
+        conn.execute('INSERT OR IGNORE INTO snapshot_runs (steamid, taken_at) VALUES (?, ?)', (steamid, now))
+    update_leaderboards(conn, steamid, playtime_leaderboard_scores(games))
+    set_ingestion_state(conn, steamid, 'owned_games_at', now)
+    return [row[1] for row in changed_rows]
+
+
+#
+# Each step is independent, one failing (e.g. Steam rejecting the friend list) doesn't skip the others
+#
+def ingest_user(steamid):
+    games, changed, friends = None, [], []
+    try:
+        games = fetch_owned_games(steamid, use_memo=False).get('response', {}).get('games')
+        if games is not None:
+            changed = store_owned_games(steamid, games)
+    except (requests.RequestException, ValueError) as e:
+        print(f"Error ingesting owned games of {steamid}: {e}")
+
+    try:
+        friends = fetch_visible_friend_list(steamid)
+        store_friend_list(steamid, friends)
+    except (requests.RequestException, ValueError, KeyError) as e:
+        print(f"Error ingesting friend list of {steamid}: {e}")
+
+    if games:
+        # Keeps the library_value leaderboard current, prices come from the shared catalog
+        library_value_payload(steamid, games, 'us')
+    return changed, [friend['steamid'] for friend in friends]
+
+
+def ingest_all_users():
+    conn = get_db()
+    try:
+        steam_ids = [row[0] for row in conn.execute('SELECT steam_id FROM users')]
+    finally:
+        conn.close()
+
+    friend_ids = set()
+    for steamid, ingested, error in fan_out(ingest_user, steam_ids, INGESTION_MAX_WORKERS, API_HOST):
+        if error:
+            print(f"Error ingesting {steamid}: {error}")
+            continue
+        changed, friends = ingested
+        friend_ids.update(friends)
+        print(f"Ingested {steamid}: {len(changed)} games changed")
+
+    # Users and their friends are summarized in batches of 100
+    store_player_summaries(get_player_summaries_batch(list(dict.fromkeys(steam_ids + sorted(friend_ids)))))
+    return len(steam_ids)
+
+
+def run_ingestion_scheduler(interval):
+    while True:
+        try:
+            if take_lease('ingestion', BACKGROUND_LEASE_RUNS * interval):
+                ingest_all_users()
+        except Exception as e:
+            print(f"Ingestion run failed: {e}")
+        time.sleep(interval)
+
+
+def start_ingestion_scheduler():
+    if INGESTION_INTERVAL > 0:
+        threading.Thread(target=run_ingestion_scheduler, args=(INGESTION_INTERVAL,), name='ingestion', daemon=True).start()
+
+
+@app.cli.command('ingest')
+@click.option('--loop', is_flag=True, help='Keep running every --interval seconds')
+@click.option('--interval', default=INGESTION_INTERVAL or 15 * 60, help='Seconds between runs with --loop')
+def ingest_command(loop, interval):
+    if loop:
+        run_ingestion_scheduler(interval)
+    else:
+        print(f"Ingested {ingest_all_users()} users")
+
+
+
+
+#
+# Friend graph
+# Friend lists of anyone (registered or not) are kept in friend_edges for FRIEND_LIST_TTL seconds.
+# Private profiles are stored with no edges, so they aren't asked for again until the TTL runs out.
+#
+FRIEND_LIST_TTL = int(os.getenv('FRIEND_LIST_TTL', 24 * 60 * 60))
+FRIEND_GRAPH_MAX_WORKERS = 8
+FRIEND_GRAPH_MAX_DEPTH = 3
+FRIEND_GRAPH_MAX_NODES = 5000
+# Seconds a friend-graph request may spend fetching friend lists, the graph is truncated past that
+FRIEND_GRAPH_TIMEOUT = float(os.getenv('FRIEND_GRAPH_TIMEOUT', 10))
+
+
+def load_friend_lists(steam_ids, max_age):
+    friend_lists = {}
+    conn = get_db()
+    try:
+        for i in range(0, len(steam_ids), SQLITE_MAX_PARAMS):
+            chunk = steam_ids[i:i + SQLITE_MAX_PARAMS]
+            placeholders = ','.join('?' * len(chunk))
+            recent = conn.execute(
+                f'SELECT steamid FROM ingestion_state WHERE steamid IN ({placeholders}) AND friends_at > ?',
+                chunk + [time.time() - max_age]
+            ).fetchall()
+            friend_lists.update({steamid: [] for steamid, in recent})
+            rows = conn.execute(f'''
+                SELECT steamid, friend_steamid, relationship, friend_since FROM friend_edges
+                WHERE steamid IN ({placeholders}) ORDER BY rowid
+            ''', chunk)
+            for steamid, friend_steamid, relationship, friend_since in rows:
+                if steamid in friend_lists:
+                    friend_lists[steamid].append({'steamid': friend_steamid, 'relationship': relationship, 'friend_since': friend_since})
+    finally:
+        conn.close()
+    return friend_lists
+
+
+#
+# Friend lists for many steam ids, cached ones from friend_edges, the rest fetched concurrently
+# Fetches still running after 'timeout' seconds are cancelled and reported as FanOutCancelled errors
+# Returns ({steamid: [friend, ...]}, {steamid: error})
+#
+def get_friend_lists(steam_ids, fresh=False, timeout=None):
+    steam_ids = list(dict.fromkeys(str(steam_id) for steam_id in steam_ids))
+    friend_lists = {} if fresh else load_friend_lists(steam_ids, FRIEND_LIST_TTL)
+    missing = [steamid for steamid in steam_ids if steamid not in friend_lists]
+    if not fresh:
+        metrics.record_cache('friend_lists', hits=len(steam_ids) - len(missing), misses=len(missing))
+
+    errors = {}
+    if missing:
+        for steamid, friends, error in fan_out(fetch_visible_friend_list, missing, FRIEND_GRAPH_MAX_WORKERS, API_HOST, timeout):
+            if error:
+                errors[steamid] = error
+            else:
+                friend_lists[steamid] = friends
+                store_friend_list(steamid, friends)
+
+    if errors:
+        stale = load_friend_lists(list(errors), max_age=float('inf'))
+        if stale:
+            mark_stale()
+            friend_lists.update(stale)
+            errors = {steamid: error for steamid, error in errors.items() if steamid not in stale}
+    return friend_lists, errors
+
+
+#
+# Friends of friends
+# Breadth first expansion from 'steamid' up to 'depth' hops (default 2)
+# Stops expanding (and fetching friend lists) once 'max_nodes' is reached or after FRIEND_GRAPH_TIMEOUT seconds,
+# either way the graph is marked truncated
+# Returns the nodes with their hop count and player summary, and the friend edges between them
+#
+@app.route('/steam/api/friend-graph', methods=['GET'])
+def friend_graph():
+    steamid = request.args.get('steamid')
+    if not steamid:
+        return jsonify({'error': 'steamid parameter is required'}), 400
+    try:
+        depth = min(int(request.args.get('depth', 2)), FRIEND_GRAPH_MAX_DEPTH)
+        max_nodes = min(int(request.args.get('max_nodes', 500)), FRIEND_GRAPH_MAX_NODES)
+    except ValueError:
+        return jsonify({'error': 'depth and max_nodes must be integers'}), 400
+
+    hops = {steamid: 0}
+    edges = []
+    errors = {}
+    truncated = False
+    frontier = [steamid]
+    deadline = time.monotonic() + FRIEND_GRAPH_TIMEOUT
+
+    for hop in range(1, depth + 1):
+        if not frontier or truncated:
+            break
+        friend_lists, level_errors = get_friend_lists(frontier, fresh=wants_fresh(),
+                                                      timeout=max(deadline - time.monotonic(), 0))
+        for node, error in level_errors.items():
+            if isinstance(error, FanOutCancelled):
+                truncated = True
+            else:
+                errors[node] = error
+        if isinstance(errors.get(steamid), steam_client.SteamUnavailable):
+            raise errors[steamid]
+        next_frontier = []
+        for node in frontier:
+            for friend in friend_lists.get(node, []):
+                friend_id = friend['steamid']
+                if friend_id not in hops:
+                    if len(hops) >= max_nodes:
+                        truncated = True
+                        continue
+                    hops[friend_id] = hop
+                    next_frontier.append(friend_id)
+                edges.append({'from': node, 'to': friend_id, 'friend_since': friend.get('friend_since')})
+        frontier = next_frontier
+
+    nodes = []
+    for node, summary in zip(hops, resolve_player_summaries(list(hops), fresh=wants_fresh())):
+        nodes.append({
+            'steamid': node,
+            'hops': hops[node],
+            'personaname': summary.get('personaname'),
+            'avatarmedium': summary.get('avatarmedium'),
+        })
+
+    graph = {'steamid': steamid, 'depth': depth, 'nodes': nodes, 'edges': edges, 'truncated': truncated}
+    if errors:
+        graph['errors'] = error_messages(errors)
+    return jsonify(graph)
+
+
+
+
+#
+# Library overlap
+# Every stored library is also kept in library_index as two packed arrays (appids sorted, playtimes in the same order),
+# so hundreds of libraries load in one query and compare with set intersections instead of lists of dicts.
+# Libraries of users that aren't registered (friends) are only kept there, not in owned_games.
+#
+LIBRARY_MAX_WORKERS = 8
+LIBRARY_OVERLAP_MAX_USERS = 50
+
+
+def pack_library(games):
+    pairs = sorted((game['appid'], game.get('playtime_forever', 0)) for game in games)
+    appids = array('I', [appid for appid, _ in pairs])
+    playtimes = array('I', [playtime for _, playtime in pairs])
+    return appids.tobytes(), playtimes.tobytes()
+
+
+def write_library(conn, steamid, games, now):
+    conn.execute(
+        'INSERT OR REPLACE INTO library_index (steamid, appids, playtimes, stored_at) VALUES (?, ?, ?, ?)',
+        (steamid,) + pack_library(games) + (now,)
+    )
+
+
+def unpack_library(appids_blob, playtimes_blob):
+    appids, playtimes = array('I'), array('I')
+    appids.frombytes(appids_blob)
+    playtimes.frombytes(playtimes_blob)
+    return dict(zip(appids, playtimes))
+
+
+def load_local_libraries(steam_ids):
+    libraries = {}
+    conn = get_db()
+    try:
+        for i in range(0, len(steam_ids), SQLITE_MAX_PARAMS):
+            chunk = steam_ids[i:i + SQLITE_MAX_PARAMS]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(f'''
+                SELECT steamid, appids, playtimes FROM library_index
+                WHERE steamid IN ({placeholders}) AND stored_at > ?
+            ''', chunk + [time.time() - INGESTION_MAX_AGE])
+            libraries.update({steamid: unpack_library(appids, playtimes) for steamid, appids, playtimes in rows})
+    finally:
+        conn.close()
+    return libraries
+
+
+#
+# Libraries as {steamid: {appid: playtime_forever}}, from library_index when recent,
+# the rest fetched concurrently then stored in one transaction from this thread,
+# like an ingestion run would for registered users and only in library_index for anyone else
+# Returns (libraries, {steamid: error})
+#
+def get_libraries(steam_ids, fresh=False):
+    steam_ids = list(dict.fromkeys(str(steam_id) for steam_id in steam_ids))
+    libraries = {} if fresh else load_local_libraries(steam_ids)
+    missing = [steamid for steamid in steam_ids if steamid not in libraries]
+    if not fresh:
+        metrics.record_cache('library_index', hits=len(steam_ids) - len(missing), misses=len(missing))
+
+    def fetch(steamid):
+        return fetch_owned_games(steamid, use_memo=not fresh).get('response', {}).get('games')
+
+    errors = {}
+    fetched = {}
+    for steamid, games, error in fan_out(fetch, missing, LIBRARY_MAX_WORKERS, API_HOST):
+        if error:
+            errors[steamid] = error
+        elif games is None:
+            # GetOwnedGames answers an empty response for private profiles
+            errors[steamid] = ValueError('Library is private')
+        else:
+            fetched[steamid] = games
+            libraries[steamid] = {game['appid']: game.get('playtime_forever', 0) for game in games}
+
+    if fetched:
+        store_libraries(fetched)
+    return libraries, errors
+
+
+#
+# A failed write only costs the cache, the libraries were already fetched
+#
+def store_libraries(fetched):
+    now = time.time()
+    conn = get_db()
+    try:
+        registered = set()
+        steam_ids = list(fetched)
+        for i in range(0, len(steam_ids), SQLITE_MAX_PARAMS):
+            chunk = steam_ids[i:i + SQLITE_MAX_PARAMS]
+            placeholders = ','.join('?' * len(chunk))
+            registered.update(row[0] for row in conn.execute(f'SELECT steam_id FROM users WHERE steam_id IN ({placeholders})', chunk))
+
+        for steamid, games in fetched.items():
+            if steamid in registered:
+                write_owned_games(conn, steamid, games, now)
+            else:
+                write_library(conn, steamid, games, now)
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Error storing {len(fetched)} libraries: {e}")
+    finally:
+        conn.close()
+
+
+def library_similarity(library, other):
+    shared = len(library.keys() & other.keys())
+    union = len(library) + len(other) - shared
+    return shared, round(shared / union, 4) if union else 0.0
+
+
+def load_game_names(steamid, appids):
+    conn = get_db()
+    try:
+        load_library_appids(conn, appids)
+        return dict(conn.execute('''
+            SELECT o.appid, o.name FROM owned_games o JOIN library_appids l ON l.appid = o.appid
+            WHERE o.steamid = ?
+        ''', (steamid,)))
+    finally:
+        conn.close()
+
+
+#
+# Games shared by every user in 'steamids' (comma separated) with each user's and the combined playtime,
+# plus the Jaccard similarity of every pair of libraries
+#
+@app.route('/steam/api/library-overlap', methods=['GET'])
+def library_overlap():
+    steam_ids = list(dict.fromkeys(steamid for steamid in request.args.get('steamids', '').split(',') if steamid))
+    if len(steam_ids) < 2:
+        return jsonify({'error': 'steamids parameter needs at least two comma separated steam ids'}), 400
+    if len(steam_ids) > LIBRARY_OVERLAP_MAX_USERS:
+        return jsonify({'error': f'At most {LIBRARY_OVERLAP_MAX_USERS} steam ids are supported'}), 400
+
+    libraries, errors = get_libraries(steam_ids, fresh=wants_fresh())
+    steam_ids = [steamid for steamid in steam_ids if steamid in libraries]
+    if len(steam_ids) < 2:
+        for error in errors.values():
+            if isinstance(error, steam_client.SteamUnavailable):
+                raise error
+        return jsonify({'error': 'Fewer than two libraries could be loaded', 'errors': error_messages(errors)}), 500
+
+    # Intersect starting from the smallest library
+    by_size = sorted((libraries[steamid] for steamid in steam_ids), key=len)
+    shared = by_size[0].keys() & by_size[1].keys()
+    for library in by_size[2:]:
+        shared &= library.keys()
+
+    names = load_game_names(steam_ids[0], shared)
+    shared_games = []
+    for appid in shared:
+        playtimes = {steamid: libraries[steamid][appid] for steamid in steam_ids}
+        shared_games.append({
+            'appid': appid,
+            'name': names.get(appid),
+            'playtime_forever': playtimes,
+            'combined_playtime': sum(playtimes.values())
+        })
+    shared_games.sort(key=lambda game: game['combined_playtime'], reverse=True)
+
+    pairs = []
+    for i, steamid in enumerate(steam_ids):
+        for other in steam_ids[i + 1:]:
+            shared_count, jaccard = library_similarity(libraries[steamid], libraries[other])
+            pairs.append({'steamids': [steamid, other], 'shared_games': shared_count, 'jaccard': jaccard})
+
+    overlap = {'steamids': steam_ids, 'shared_games': shared_games, 'pairs': pairs}
+    if errors:
+        overlap['errors'] = error_messages(errors)
+    return jsonify(overlap)
+
+
+#
+# Friends of 'steamid' ranked by how similar their libraries are (Jaccard over appids)
+# Takes in url params 'steamid' and 'amount' (default 10)
+#
+@app.route('/steam/api/similar-friends', methods=['GET'])
+def similar_friends():
+    steamid = request.args.get('steamid')
+    if not steamid:
+        return jsonify({'error': 'steamid parameter is required'}), 400
+    amount = int(request.args.get('amount', '10'))
+
+    friend_lists, errors = get_friend_lists([steamid], fresh=wants_fresh())
+    if steamid in errors:
+        return fetch_error_response(errors[steamid])
+    friend_ids = [friend['steamid'] for friend in friend_lists[steamid]]
+
+    libraries, errors = get_libraries([steamid] + friend_ids, fresh=wants_fresh())
+    if steamid not in libraries:
+        return fetch_error_response(errors[steamid])
+    library = libraries[steamid]
+
+    ranked = []
+    for friend_id in friend_ids:
+        if friend_id in libraries:
+            shared_count, jaccard = library_similarity(library, libraries[friend_id])
+            ranked.append((jaccard, shared_count, friend_id))
+    top = heapq.nlargest(amount, ranked)
+
+    friends = []
+    for (jaccard, shared_count, friend_id), summary in zip(top, resolve_player_summaries([friend_id for _, _, friend_id in top])):
+        friends.append({
+            'steamid': friend_id,
+            'personaname': summary.get('personaname'),
+            'avatarmedium': summary.get('avatarmedium'),
+            'shared_games': shared_count,
+            'jaccard': jaccard
+        })
+    return jsonify({'steamid': steamid, 'friends': friends, 'unavailable': sorted(errors)})
+
+
+
+
+#
+# Playtime history
+# store_owned_games appends a playtime_snapshots row whenever a game's playtime_forever changes
+# and records every snapshot in snapshot_runs. The playtime of a game at any time is its latest row
+# before then, and since playtime_forever never goes down that is simply the MAX.
+# Weekly numbers come from one query over the snapshots, deltas only count weeks after a user's first snapshot.
+#
+WEEK_SECONDS = 7 * 24 * 60 * 60
+PLAYTIME_HISTORY_MAX_WEEKS = 104
+ROLLING_AVERAGE_WEEKS = 4
+
+
+def history_weeks(default):
+    return max(1, min(int(request.args.get('weeks', default)), PLAYTIME_HISTORY_MAX_WEEKS))
+
+
+#
+# Cumulative playtime at each week boundary (oldest first) of every game that changed in the last 'weeks' weeks
+# Returns (boundaries, {appid: [minutes at each boundary]}, time of the first snapshot or None)
+#
+def weekly_playtime(steamid, weeks):
+    now = time.time()
+    boundaries = [now - (weeks - k) * WEEK_SECONDS for k in range(weeks + 1)]
+    conn = get_db()
+    try:
+        first_snapshot = conn.execute('SELECT MIN(taken_at) FROM snapshot_runs WHERE steamid = ?', (steamid,)).fetchone()[0]
+        rows = conn.execute('''
+            SELECT CAST(b.key AS INTEGER), p.appid, MAX(p.playtime_forever)
+            FROM json_each(?) b
+            JOIN playtime_snapshots p ON p.steamid = ? AND p.taken_at <= b.value
+            WHERE p.appid IN (SELECT appid FROM playtime_snapshots WHERE steamid = ? AND taken_at > ?)
+            GROUP BY b.key, p.appid
+        ''', (json.dumps(boundaries), steamid, steamid, boundaries[0])).fetchall()
+    finally:
+        conn.close()
+
+    series = {}
+    for k, appid, playtime in rows:
+        series.setdefault(appid, [0] * (weeks + 1))[k] = playtime
+    return boundaries, series, first_snapshot
+
+
+def weekly_deltas(values, boundaries, first_snapshot):
+    # A week that started before the first snapshot would count the whole library as played that week
+    return [
+        values[k + 1] - values[k] if boundaries[k] >= first_snapshot else None
+        for k in range(len(boundaries) - 1)
+    ]
+
+
+def rolling_averages(deltas, window=ROLLING_AVERAGE_WEEKS):
+    averages = []
+    for k in range(len(deltas)):
+        known = [delta for delta in deltas[max(0, k - window + 1):k + 1] if delta is not None]
+        averages.append(round(statistics.fmean(known), 1) if known else None)
+    return averages
+
+
+def trend_slope(deltas):
+    points = [(week, delta) for week, delta in enumerate(deltas) if delta is not None]
+    if len(points) < 2:
+        return None
+    return round(statistics.linear_regression([week for week, _ in points], [delta for _, delta in points]).slope, 2)
+
+
+#
+# Weekly playtime of a user, from the snapshots taken by ingestion
+# Takes in url params 'steamid' and 'weeks' (default 12)
+#
+@app.route('/steam/api/playtime-history', methods=['GET'])
+def playtime_history():
+    steamid = request.args.get('steamid')
+    if not steamid:
+        return jsonify({'error': 'steamid parameter is required'}), 400
+    try:
+        weeks = history_weeks(12)
+    except ValueError:
+        return jsonify({'error': 'weeks must be an integer'}), 400
+
+    boundaries, series, first_snapshot = weekly_playtime(steamid, weeks)
+    if first_snapshot is None:
+        return jsonify({'error': 'No playtime snapshots for this user yet, they are taken by ingestion'}), 404
+
+    totals = [sum(values[k] for values in series.values()) for k in range(weeks + 1)]
+    deltas = weekly_deltas(totals, boundaries, first_snapshot)
+    averages = rolling_averages(deltas)
+    return jsonify({
+        'steamid': steamid,
+        'first_snapshot': int(first_snapshot),
+        'total_minutes': sum(delta for delta in deltas if delta is not None),
+        'weeks': [
+            {
+                'week_start': int(boundaries[k]),
+                'week_end': int(boundaries[k + 1]),
+                'minutes': deltas[k],
+                'rolling_average_minutes': averages[k]
+            }
+            for k in range(weeks)
+        ]
+    })
+
+
+#
+# Per game weekly playtime and trend (least squares slope, minutes per week per week)
+# Takes in url params 'steamid', 'weeks' (default 12), 'amount' (default 10)
+# and 'sort' = 'total' (default), 'rising' or 'falling'
+#
+@app.route('/steam/api/playtime-trends', methods=['GET'])
+def playtime_trends():
+    steamid = request.args.get('steamid')
+    if not steamid:
+        return jsonify({'error': 'steamid parameter is required'}), 400
+    try:
+        weeks = history_weeks(12)
+        amount = int(request.args.get('amount', 10))
+    except ValueError:
+        return jsonify({'error': 'weeks and amount must be integers'}), 400
+    sort = request.args.get('sort', 'total')
+    if sort not in ('total', 'rising', 'falling'):
+        return jsonify({'error': "sort must be 'total', 'rising' or 'falling'"}), 400
+
+    boundaries, series, first_snapshot = weekly_playtime(steamid, weeks)
+    if first_snapshot is None:
+        return jsonify({'error': 'No playtime snapshots for this user yet, they are taken by ingestion'}), 404
+
+    games = []
+    for appid, values in series.items():
+        deltas = weekly_deltas(values, boundaries, first_snapshot)
+        total = sum(delta for delta in deltas if delta is not None)
+        if total:
+            games.append({'appid': appid, 'total_minutes': total, 'weekly_minutes': deltas, 'slope': trend_slope(deltas)})
+
+    if sort == 'total':
+        top = heapq.nlargest(amount, games, key=lambda game: game['total_minutes'])
+    else:
+        games = [game for game in games if game['slope'] is not None]
+        top = (heapq.nlargest if sort == 'rising' else heapq.nsmallest)(amount, games, key=lambda game: game['slope'])
+
+    names = load_game_names(steamid, [game['appid'] for game in top])
+    for game in top:
+        game['name'] = names.get(game['appid'])
+    return jsonify({'steamid': steamid, 'week_starts': [int(boundary) for boundary in boundaries[:-1]], 'games': top})
+
+
+#
+# Where a user's playtime over the last 'weeks' weeks (default 4) ranks among all registered users
+# Only users whose snapshots go back to the start of that window are ranked
+#
+@app.route('/steam/api/playtime-percentile', methods=['GET'])
+def playtime_percentile():
+    steamid = request.args.get('steamid')
+    if not steamid:
+        return jsonify({'error': 'steamid parameter is required'}), 400
+    try:
+        weeks = history_weeks(4)
+    except ValueError:
+        return jsonify({'error': 'weeks must be an integer'}), 400
+
+    start = time.time() - weeks * WEEK_SECONDS
+    conn = get_db()
+    try:
+        playtimes = dict(conn.execute('''
+            SELECT d.steamid, SUM(d.minutes) FROM (
+                SELECT p.steamid,
+                    MAX(p.playtime_forever) - COALESCE(MAX(CASE WHEN p.taken_at <= ? THEN p.playtime_forever END), 0) AS minutes
+                FROM playtime_snapshots p
+                JOIN users u ON u.steam_id = p.steamid
+                WHERE p.steamid IN (SELECT steamid FROM snapshot_runs GROUP BY steamid HAVING MIN(taken_at) <= ?)
+                GROUP BY p.steamid, p.appid
+            ) d
+            GROUP BY d.steamid
+        ''', (start, start)))
+    finally:
+        conn.close()
+
+    if steamid not in playtimes:
+        return jsonify({'error': f'No registered user with playtime snapshots going back {weeks} weeks'}), 404
+
+    minutes = playtimes[steamid]
+    population = sorted(playtimes.values())
+    below = bisect.bisect_left(population, minutes)
+    equal = bisect.bisect_right(population, minutes) - below
+    return jsonify({
+        'steamid': steamid,
+        'weeks': weeks,
+        'minutes': minutes,
+        'percentile': round((below + equal / 2) / len(population) * 100, 1),
+        'population': len(population)
+    })
+
+
+
+
+#
+# Leaderboards
+# One leaderboard_entries row per (board, registered user), kept up to date wherever the score is computed:
+# total_hours and most_played when owned games are stored, library_value (US store) and rarest_achievement
+# when they're computed by their routes, jobs, the profile summary or ingestion.
+# Pages and ranks come from the (board, score, steamid) index, steamid follows the score's direction on ties:
+# the higher steamid ranks first on the DESC boards, the lower one on rarest_achievement (ASC).
+#
+LEADERBOARDS = {
+    'total_hours': 'DESC',
+    'most_played': 'DESC',
+    'library_value': 'DESC',
+    'rarest_achievement': 'ASC',
+}
+LEADERBOARD_MAX_AMOUNT = 100
+
+
+#
+# 'scores' maps boards to (score, detail dict or None), or to None to drop the user from that board
+# Users that aren't registered are ignored
+#
+def update_leaderboards(conn, steamid, scores):
+    if not conn.execute('SELECT 1 FROM users WHERE steam_id = ?', (steamid,)).fetchone():
+        return
+    now = time.time()
+    for board, entry in scores.items():
+        if entry is None:
+            conn.execute('DELETE FROM leaderboard_entries WHERE board = ? AND steamid = ?', (board, steamid))
+        else:
+            score, detail = entry
+            conn.execute('''
+                INSERT OR REPLACE INTO leaderboard_entries (board, steamid, score, detail, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (board, steamid, score, json.dumps(detail) if detail else None, now))
+
+
+def record_leaderboard_scores(steamid, scores):
+    conn = get_db()
+    try:
+        update_leaderboards(conn, str(steamid), scores)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def playtime_leaderboard_scores(games):
+    total_minutes = sum(game.get('playtime_forever', 0) for game in games)
+    top = max(games, key=lambda game: game.get('playtime_forever', 0), default=None)
+    return {
+        'total_hours': (round(total_minutes / 60, 1), None),
+        'most_played': (
+            (round(top['playtime_forever'] / 60, 1), {'appid': top['appid'], 'name': top.get('name')})
+            if top and top.get('playtime_forever') else None
+        )
+    }
+
+
+def leaderboard_entry(row, rank):
+    steamid, score, detail, updated_at, personaname, avatarmedium = row
+    entry = {
+        'rank': rank,
+        'steamid': steamid,
+        'personaname': personaname,
+        'avatarmedium': avatarmedium,
+        'score': score,
+        'updated_at': int(updated_at)
+    }
+    if detail:
+        entry.update(json.loads(detail))
+    return entry
+
+
+LEADERBOARD_COLUMNS = 'e.steamid, e.score, e.detail, e.updated_at, p.personaname, p.avatarmedium'
+LEADERBOARD_TABLES = 'leaderboard_entries e LEFT JOIN player_summaries p ON p.steamid = e.steamid'
+
+
+#
+# A page of a leaderboard
+# Takes in url params 'board', 'amount' (default 25) and 'cursor', the next_cursor of the previous page
+#
+@app.route('/steam/api/leaderboard', methods=['GET'])
+def leaderboard():
+    board = request.args.get('board')
+    if board not in LEADERBOARDS:
+        return jsonify({'error': f"board must be one of {', '.join(LEADERBOARDS)}"}), 400
+    try:
+        amount = max(1, min(int(request.args.get('amount', 25)), LEADERBOARD_MAX_AMOUNT))
+    except ValueError:
+        return jsonify({'error': 'amount must be an integer'}), 400
+
+    order = LEADERBOARDS[board]
+    after = '<' if order == 'DESC' else '>'
+    conn = get_db()
+    try:
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                rank, score, steamid = cursor.split(':', 2)
+                rank, score = int(rank), float(score)
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            rows = conn.execute(f'''
+                SELECT {LEADERBOARD_COLUMNS} FROM {LEADERBOARD_TABLES}
+                WHERE e.board = ? AND (e.score, e.steamid) {after} (?, ?)
+                ORDER BY e.score {order}, e.steamid {order} LIMIT ?
+            ''', (board, score, steamid, amount)).fetchall()
+        else:
+            rank = 0
+            rows = conn.execute(f'''
+                SELECT {LEADERBOARD_COLUMNS} FROM {LEADERBOARD_TABLES}
+                WHERE e.board = ?
+                ORDER BY e.score {order}, e.steamid {order} LIMIT ?
+            ''', (board, amount)).fetchall()
+    finally:
+        conn.close()
+
+    entries = [leaderboard_entry(row, rank + i + 1) for i, row in enumerate(rows)]
+    last = entries[-1] if len(entries) == amount else None
+    return jsonify({
+        'board': board,
+        'entries': entries,
+        'next_cursor': f"{last['rank']}:{last['score']!r}:{last['steamid']}" if last else None
+    })
+
+
+#
+# A user's entry and rank on one leaderboard, or on all of them without 'board'
+# Takes in url params 'steamid' and optional 'board'
+#
+@app.route('/steam/api/leaderboard-rank', methods=['GET'])
+def leaderboard_rank():
+    steamid = request.args.get('steamid')
+    if not steamid:
+        return jsonify({'error': 'steamid parameter is required'}), 400
+    board = request.args.get('board')
+    if board is not None and board not in LEADERBOARDS:
+        return jsonify({'error': f"board must be one of {', '.join(LEADERBOARDS)}"}), 400
+
+    ranks = {}
+    conn = get_db()
+    try:
+        for name in [board] if board else LEADERBOARDS:
+            order = LEADERBOARDS[name]
+            ahead = '>' if order == 'DESC' else '<'
+            row = conn.execute(f'''
+                SELECT {LEADERBOARD_COLUMNS},
+                    (SELECT COUNT(*) FROM leaderboard_entries a
+                     WHERE a.board = e.board AND (a.score, a.steamid) {ahead} (e.score, e.steamid)),
+                    (SELECT COUNT(*) FROM leaderboard_entries t WHERE t.board = e.board)
+                FROM {LEADERBOARD_TABLES}
+                WHERE e.board = ? AND e.steamid = ?
+            ''', (name, steamid)).fetchone()
+            if row:
+                ranks[name] = dict(leaderboard_entry(row[:6], row[6] + 1), total=row[7])
+    finally:
+        conn.close()
+
+    if not ranks:
+        return jsonify({'error': 'This user is not on any leaderboard yet'}), 404
+    return jsonify({'steamid': steamid, 'leaderboards': ranks})
+
+
+
+
+#
+# Profile summary
+# One call for everything the profile page shows.
+# Owned games and the player summary are fetched once, the playtime aggregates
+# are computed in a single pass, and the sections that need more upstream data run concurrently.
+# library_value and rare_achievements become a job (see Jobs) when they'd take longer than JOB_ASYNC_SECONDS,
+# the section is then {"job_id": ..., "status_url": ...}. 'sync=1' always computes them.
+# Takes in url params 'steamid' and optional 'sections' (comma separated, defaults to all)
+#
+PROFILE_SECTIONS = ('total_hours', 'average_hours_per_week', 'most_played', 'top_categories', 'library_value', 'rare_achievements')
+
+
+def summarize_owned_games(games, top_n=20):
+    total_minutes = 0
+    most_played = []  # min heap of (playtime, -position, game), holds the top_n most played games
+
+    for position, game in enumerate(games):
+        playtime = game.get('playtime_forever', 0)
+        total_minutes += playtime
+        if playtime > 0:
+            if len(most_played) < top_n:
+                heapq.heappush(most_played, (playtime, -position, game))
+            elif (playtime, -position) > most_played[0][:2]:
+                heapq.heapreplace(most_played, (playtime, -position, game))
+
+    # Ties keep their original order, same as the stable sort in get_most_played
+    return total_minutes, [game for _, _, game in sorted(most_played, key=lambda x: x[:2], reverse=True)]
+
+
+@app.route('/steam/api/profile-summary', methods=['GET'])
+def profile_summary():
+    steamid = request.args.get('steamid')
+    if not steamid:
+        return jsonify({'error': 'steamid parameter is required'}), 400
+
+    sections = request.args.get('sections')
+    sections = [section.strip() for section in sections.split(',') if section.strip()] if sections else list(PROFILE_SECTIONS)
+    unknown = [section for section in sections if section not in PROFILE_SECTIONS]
+    if unknown:
+        return jsonify({'error': f"Unknown sections: {', '.join(unknown)}"}), 400
+
+    with ContextThreadPoolExecutor(max_workers=4) as executor:
+        player_future = executor.submit(get_player_summaries, steamid, wants_fresh()) if 'average_hours_per_week' in sections else None
+
+        try:
+            owned_games_response = get_owned_games(steamid, fresh=wants_fresh())
+        except steam_client.SteamUnavailable:
+            raise
+        except (requests.RequestException, ValueError) as e:
+            return jsonify({'error': str(e)}), 500
+        if not owned_games_response or 'games' not in owned_games_response.get('response', {}):
+            return jsonify({'error': 'Failed to fetch owned games or no games found.'}), 400
+
+        games = owned_games_response['response']['games']
+        total_minutes, most_played = summarize_owned_games(games)
+
+        # Sections that need more data from Steam
+        futures = {}
+        if 'top_categories' in sections:
+            futures['top_categories'] = executor.submit(count_top_genres, most_played[:10])
+        summary = {'steamid': steamid}
+        errors = {}
+
+        if 'library_value' in sections:
+            if not wants_sync() and estimate_library_value_seconds(games, 'us') > JOB_ASYNC_SECONDS:
+                summary['library_value'] = start_job('library_value', steamid, {'cc': 'us'})
+            else:
+                futures['library_value'] = executor.submit(lambda: library_value_payload(steamid, games, 'us')['total_library_value'])
+        if 'rare_achievements' in sections:
+            if not wants_sync() and estimate_rare_achievements_seconds(games) > JOB_ASYNC_SECONDS:
+                summary['rare_achievements'] = start_job('rare_achievements', steamid)
+            else:
+                futures['rare_achievements'] = executor.submit(find_rare_achievements, steamid, games)
+
+        if 'total_hours' in sections:
+            summary['total_hours'] = floor(total_minutes / 60)
+        if 'most_played' in sections:
+            summary['most_played'] = [most_played_entry(game) for game in most_played]
+        if player_future:
+            try:
+                players = player_future.result()['response']['players']
+                account_creation = players[0].get('timecreated') if players else None
+                if account_creation:
+                    summary['average_hours_per_week'] = (total_minutes / 60) / weeks_since(account_creation)
+                else:
+                    errors['average_hours_per_week'] = 'Account creation date not available.'
+            except (requests.RequestException, ValueError) as e:
+                errors['average_hours_per_week'] = str(e)
+
+        for section, future in futures.items():
+            try:
+                summary[section] = future.result()
+            except (requests.RequestException, ValueError) as e:
+                errors[section] = str(e)
+
+    if errors:
+        summary['errors'] = errors
+    return jsonify(summary)
+
+
+
+
+#
+# Background threads
+# The ingestion scheduler and the store prefetcher start with the first request a process serves,
+# so importing the app (flask cli commands, tests, bench tools) doesn't start them.
+# Every serving process (e.g. each gunicorn worker) starts them, but before each run a thread takes
+# a lease in background_leases, so only one process at a time ingests or prefetches.
+# A lease lasts BACKGROUND_LEASE_RUNS intervals, if its owner dies another process takes over after that.
+# Store snapshots live in the memory of the process holding the 'store-prefetch' lease,
+# the other processes serve those feeds from their response cache.
+#
+BACKGROUND_LEASE_RUNS = 3
+background_lock = threading.Lock()
+background_started = False
+
+
+def take_lease(name, seconds):
+    conn = get_db()
+    try:
+        now = time.time()
+        # Looked up per call, workers forked after import have their own pid
+        owner = f'{socket.gethostname()}:{os.getpid()}'
+        cursor = conn.execute('''
+            INSERT INTO background_leases (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE background_leases.owner = excluded.owner OR background_leases.expires_at < ?
+        ''', (name, owner, now + seconds, now))
+        conn.commit()
+        return cursor.rowcount == 1
+    finally:
+        conn.close()
+
 
+@app.before_request
+def start_background_threads():
+    global background_started
+    if background_started:
+        return
+    with background_lock:
+        if not background_started:
+            background_started = True
+            start_ingestion_scheduler()
+            start_store_prefetcher()
 
 
 if __name__ == '__main__':
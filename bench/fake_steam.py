@@ -0,0 +1,288 @@
+from werkzeug.serving import make_server
+from flask import Flask, request, jsonify
+from collections import Counter
+import threading
+import argparse
+import random
+import json
+import time
+import os
+
+
+#
+# Fake Steam
+# Local stand-in for the Steam Web API and store API used by the benchmarks.
+# Replays fixtures from a directory when there is one for a call, otherwise generates
+# deterministic synthetic data. Latency, jitter and 429 responses are configurable.
+#
+# Library size is encoded in the steamid: SYNTHETIC_STEAMID_BASE + n owns n games,
+# see synthetic_steamid().
+#
+# Fixture files are looked up as <interface>-<key>.json, then <interface>.json,
+# e.g. GetOwnedGames-76561190000000100.json, appdetails-1010.json, getappsingenre-Action.json
+#
+SYNTHETIC_STEAMID_BASE = 76561190000000000
+DEFAULT_LIBRARY_SIZE = 50
+FRIENDS_PER_USER = 50
+ACHIEVEMENTS_PER_APP = 20
+
+
+def synthetic_steamid(library_size):
+    return str(SYNTHETIC_STEAMID_BASE + library_size)
+
+
+def library_size(steamid):
+    size = int(steamid) - SYNTHETIC_STEAMID_BASE
+    return size if 0 < size <= 100000 else DEFAULT_LIBRARY_SIZE
+
+
+def synthetic_appid(index):
+    return 1000 + index * 10
+
+
+class FakeSteam:
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_429=0.0, fixtures=None, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.fixtures = fixtures
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self.server = None
+        self.app = self.create_app()
+
+    #
+    # Server
+    #
+    def start(self, host='127.0.0.1', port=0):
+        self.server = make_server(host, port, self.app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, name='fake-steam', daemon=True).start()
+        return f'http://{host}:{self.server.server_port}'
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls.clear()
+
+    #
+    # Shared behaviour for every endpoint: counting, latency, 429s and fixtures
+    #
+    def respond(self, interface, key, build):
+        with self._lock:
+            self.calls[interface] += 1
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            throttled = self.random.random() < self.rate_429
+        if delay:
+            time.sleep(delay)
+        if throttled:
+            return jsonify({}), 429
+
+        fixture = self.load_fixture(interface, key)
+        if fixture is not None:
+            return jsonify(fixture)
+        payload = build()
+        if isinstance(payload, tuple):
+            return jsonify(payload[0]), payload[1]
+        return jsonify(payload)
+
+    def load_fixture(self, interface, key):
+        if not self.fixtures:
+            return None
+        for name in (f'{interface}-{key}.json', f'{interface}.json'):
+            path = os.path.join(self.fixtures, name)
+            if os.path.exists(path):
+                with open(path) as f:
+                    return json.load(f)
+        return None
+
+    #
+    # Synthetic payloads
+    #
+    @staticmethod
+    def owned_games(steamid):
+        rng = random.Random(int(steamid))
+        games = []
+        for i in range(library_size(steamid)):
+            played = rng.random() > 0.3
+            game = {
+                'appid': synthetic_appid(i),
+                'name': f'Game {synthetic_appid(i)}',
+                'img_icon_url': 'icon',
+                'playtime_forever': rng.randint(1, 50000) if played else 0,
+                'rtime_last_played': rng.randint(1500000000, 1700000000) if played else 0,
+            }
+            if played and rng.random() < 0.05:
+                game['playtime_2weeks'] = rng.randint(1, 2000)
+            games.append(game)
+        return {'response': {'game_count': len(games), 'games': games}}
+
+    @staticmethod
+    def player(steamid):
+        return {
+            'steamid': steamid,
+            'personaname': f'Player {steamid[-6:]}',
+            'avatarmedium': f'https://avatars.example/{steamid}.jpg',
+            'timecreated': 1300000000 + int(steamid) % 100000000,
+        }
+
+    @staticmethod
+    def friends(steamid):
+        return {'friendslist': {'friends': [
+            {
+                'steamid': str(SYNTHETIC_STEAMID_BASE + 200000 + (int(steamid) * 31 + j) % 1000000),
+                'relationship': 'friend',
+                'friend_since': 1500000000 + j,
+            }
+            for j in range(FRIENDS_PER_USER)
+        ]}}
+
+    @staticmethod
+    def global_achievements(appid):
+        if appid % 3 == 0:
+            return {}, 403
+        rng = random.Random(appid)
+        return {'achievementpercentages': {'achievements': [
+            {'name': f'ACH_{j}', 'percent': str(round(rng.uniform(0.1, 90), 1))}
+            for j in range(ACHIEVEMENTS_PER_APP)
+        ]}}
+
+    @staticmethod
+    def player_achievements(appid, steamid):
+        rng = random.Random(appid * 7 + int(steamid))
+        return {'playerstats': {'steamID': steamid, 'success': True, 'achievements': [
+            {'apiname': f'ACH_{j}', 'achieved': 1 if rng.random() < 0.4 else 0}
+            for j in range(ACHIEVEMENTS_PER_APP)
+        ]}}
+
+    @staticmethod
+    def price(appid):
+        # One synthetic app in four is free, see synthetic_appid()
+        if (appid // 10) % 4 == 0:
+            return None
+        final = 99 + (appid * 37) % 5900
+        return {'currency': 'USD', 'initial': final, 'final': final, 'discount_percent': 0}
+
+    @staticmethod
+    def app_details(appid):
+        price = FakeSteam.price(appid)
+        genres = [{'id': '1', 'description': 'Action'}, {'id': str(appid % 7), 'description': f'Genre {appid % 7}'}]
+        data = {
+            'type': 'game',
+            'name': f'Game {appid}',
+            'steam_appid': appid,
+            'is_free': price is None,
+            'header_image': f'https://cdn.example/{appid}/header.jpg',
+            'background': f'https://cdn.example/{appid}/bg.jpg',
+            'background_raw': f'https://cdn.example/{appid}/bg_raw.jpg',
+            'developers': [f'Studio {appid % 13}'],
+            'publishers': [f'Publisher {appid % 5}'],
+            'genres': genres,
+            'categories': [{'id': 2, 'description': 'Single-player'}, {'id': 22, 'description': 'Steam Achievements'}],
+            'screenshots': [
+                {'id': j, 'path_thumbnail': f'https://cdn.example/{appid}/ss_{j}_t.jpg', 'path_full': f'https://cdn.example/{appid}/ss_{j}.jpg'}
+                for j in range(8)
+            ],
+            'movies': [
+                {
+                    'id': j, 'name': f'Trailer {j}', 'thumbnail': f'https://cdn.example/{appid}/mv_{j}.jpg',
+                    'webm': {'480': f'https://cdn.example/{appid}/mv_{j}.webm'}, 'mp4': {'480': f'https://cdn.example/{appid}/mv_{j}.mp4'}
+                }
+                for j in range(2)
+            ],
+            'achievements': {'total': ACHIEVEMENTS_PER_APP},
+            'release_date': {'date': '1 Jan, 2020'},
+            'pc_requirements': {'recommended': '<strong>Recommended:</strong><br><ul><li>OS: Windows 10</li></ul>' * 4},
+            'package_groups': [],
+        }
+        if price:
+            data['price_overview'] = price
+            data['package_groups'] = [{'name': 'default', 'subs': [{'packageid': appid, 'price_in_cents_with_discount': price['final']}]}]
+        return data
+
+    def create_app(self):
+        app = Flask('fake_steam')
+
+        @app.route('/IPlayerService/GetOwnedGames/v0001/')
+        def get_owned_games():
+            steamid = request.args['steamid']
+            return self.respond('GetOwnedGames', steamid, lambda: self.owned_games(steamid))
+
+        @app.route('/ISteamUser/GetPlayerSummaries/v0002/')
+        def get_player_summaries():
+            steamids = request.args['steamids']
+            return self.respond('GetPlayerSummaries', steamids, lambda: {'response': {'players': [
+                self.player(steamid) for steamid in steamids.split(',')[:100]
+            ]}})
+
+        @app.route('/ISteamUser/GetFriendList/v0001/')
+        def get_friend_list():
+            steamid = request.args['steamid']
+            return self.respond('GetFriendList', steamid, lambda: self.friends(steamid))
+
+        @app.route('/ISteamUserStats/GetGlobalAchievementPercentagesForApp/v0002/')
+        def get_global_achievements():
+            appid = int(request.args['gameid'])
+            return self.respond('GetGlobalAchievementPercentagesForApp', appid, lambda: self.global_achievements(appid))
+
+        @app.route('/ISteamUserStats/GetPlayerAchievements/v0001/')
+        def get_player_achievements():
+            appid, steamid = int(request.args['appid']), request.args['steamid']
+            return self.respond('GetPlayerAchievements', f'{appid}-{steamid}', lambda: self.player_achievements(appid, steamid))
+
+        @app.route('/api/appdetails')
+        def appdetails():
+            appids = [int(appid) for appid in request.args['appids'].split(',')]
+            price_only = request.args.get('filters') == 'price_overview'
+
+            def build():
+                if len(appids) > 1 and not price_only:
+                    return None, 400
+                if price_only:
+                    return {str(appid): {'success': True, 'data': {'price_overview': self.price(appid)} if self.price(appid) else []} for appid in appids}
+                return {str(appid): {'success': True, 'data': self.app_details(appid)} for appid in appids}
+
+            return self.respond('appdetails', request.args['appids'], build)
+
+        @app.route('/api/featured')
+        def featured():
+            return self.respond('featured', '', lambda: {'featured_win': [
+                {'id': synthetic_appid(i), 'name': f'Game {synthetic_appid(i)}', 'final_price': 1999, 'header_image': 'https://cdn.example/h.jpg'}
+                for i in range(10)
+            ]})
+
+        @app.route('/api/getappsingenre')
+        def apps_in_genre():
+            genre = request.args.get('genre', '')
+            return self.respond('getappsingenre', genre, lambda: {'name': genre, 'tabs': {
+                tab: {'name': tab, 'items': [{'id': synthetic_appid(offset + i)} for i in range(10)]}
+                for offset, tab in enumerate(('featured', 'topsellers', 'newreleases', 'specials'))
+            }})
+
+        return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the fake Steam server on its own')
+    parser.add_argument('--port', type=int, default=8901)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.02, help='+/- seconds of random extra latency')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='fraction of calls answered with 429')
+    parser.add_argument('--fixtures', help='directory of recorded responses to replay')
+    args = parser.parse_args()
+
+    fake = FakeSteam(args.latency, args.jitter, args.rate_429, args.fixtures)
+    print(f'Fake Steam on {fake.start(port=args.port)}, point STEAM_API_BASE and STEAM_STORE_BASE at it')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,237 @@
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import make_server
+import statistics
+import threading
+import argparse
+import resource
+import logging
+import tempfile
+import requests
+import json
+import time
+import sys
+import os
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_steam import FakeSteam, synthetic_steamid
+
+
+#
+# Offline benchmarks
+# Runs the Flask app against the fake Steam server and reports, per route and library size:
+# cold latency, p50/p95/p99 of warm requests, throughput with --concurrency clients,
+# upstream calls per request and how far RSS grew above its level at the start of the scenario.
+# Warm requests run in --rounds rounds. The reported p95 is the median of the per round p95s, and a route
+# only counts as a regression when every round is slower than bench/baseline.json by more than --tolerance
+# (and --min-delta-ms), so one noisy round can't fail the run. Exits with status 1 on a regression.
+#
+#   python bench/run.py --sizes 10,100,1000,10000 --requests 50 --concurrency 8
+#   python bench/run.py --update-baseline
+#
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+
+USER_ROUTES = [
+    '/steam/api/total-hours',
+    '/steam/api/most-played',
+    '/steam/api/average-hours-per-week',
+    '/steam/api/top_categories',
+    '/steam/api/library-value',
+    '/steam/api/rare-achievements',
+    '/steam/api/friends',
+    '/steam/api/similar-friends',
+    '/steam/api/profile-summary',
+]
+STORE_ROUTES = [
+    '/steam/api/game-details?appid=1010',
+    '/steam/api/featured-games/',
+    '/steam/api/apps-in-genre?genre=Action',
+    '/users',
+    '/steam/api/leaderboard?board=total_hours',
+]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+    except OSError:
+        # No /proc (e.g. macOS), fall back to the process peak, in bytes there
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 20
+
+
+#
+# Highest RSS seen while a scenario runs, ru_maxrss only ever grows so it can't be attributed to one route
+#
+class RssSampler:
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.start_mb = self.peak_mb = current_rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='rss-sampler', daemon=True)
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+
+def start_app(steam_base, rate_limits):
+    # The app reads its config from the environment at import time,
+    # and keeps steamdata.db in the working directory
+    os.environ['STEAM_API_BASE'] = steam_base
+    os.environ['STEAM_STORE_BASE'] = steam_base
+    os.environ.setdefault('STEAM_API_KEY', 'bench')
+    os.environ.setdefault('STEAM_BACKOFF_BASE', '0.05')
+    if not rate_limits:
+        for name in ('STEAM_API_RATE', 'STEAM_STORE_RATE', 'STEAM_API_BURST', 'STEAM_STORE_BURST'):
+            os.environ.setdefault(name, '100000')
+    os.chdir(tempfile.mkdtemp(prefix='steam-bench-'))
+    sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+    import app as steam_app
+    server = make_server('127.0.0.1', 0, steam_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='app', daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', steam_app
+
+
+def run_scenario(base, path, fake, total_requests, concurrency, rounds):
+    session = requests.Session()
+
+    def timed_get():
+        start = time.perf_counter()
+        response = session.get(base + path)
+        response.content
+        return time.perf_counter() - start, response.status_code
+
+    with RssSampler() as rss:
+        fake.reset_calls()
+        cold, status = timed_get()
+        cold_calls = fake.total_calls()
+
+        fake.reset_calls()
+        results = []
+        round_p95s = []
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for _ in range(rounds):
+                round_results = list(executor.map(lambda _: timed_get(), range(total_requests)))
+                round_p95s.append(percentile([latency for latency, _ in round_results], 95))
+                results.extend(round_results)
+        elapsed = time.perf_counter() - start
+    latencies = [latency for latency, _ in results]
+
+    return {
+        'status': status,
+        'errors': sum(1 for _, code in results if code >= 400),
+        'cold_ms': round(cold * 1000, 1),
+        'cold_upstream_calls': cold_calls,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(statistics.median(round_p95s) * 1000, 1),
+        'round_p95_ms': [round(p95 * 1000, 1) for p95 in round_p95s],
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 1),
+        'throughput_rps': round(len(results) / elapsed, 1),
+        'upstream_calls_per_request': round(fake.total_calls() / len(results), 2),
+        # Covers the app and the fake server, they share the process
+        'rss_growth_mb': round(rss.peak_mb - rss.start_mb, 1),
+    }
+
+
+def compare_with_baseline(results, tolerance, min_delta_ms):
+    if not os.path.exists(BASELINE_PATH):
+        print(f'No baseline at {BASELINE_PATH}, run with --update-baseline to create one')
+        return []
+    with open(BASELINE_PATH) as f:
+        baseline = json.load(f)
+
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if not expected:
+            continue
+        limit = max(expected['p95_ms'] * (1 + tolerance), expected['p95_ms'] + min_delta_ms)
+        if min(result['round_p95_ms']) > limit:
+            regressions.append(
+                f"{name}: p95 {result['p95_ms']}ms (rounds {result['round_p95_ms']}), baseline {expected['p95_ms']}ms"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Flask routes against a fake Steam')
+    parser.add_argument('--sizes', default='10,100,1000,10000', help='library sizes to test, comma separated')
+    parser.add_argument('--routes', help='only run routes containing one of these strings, comma separated')
+    parser.add_argument('--requests', type=int, default=30, help='warm requests per scenario and round')
+    parser.add_argument('--rounds', type=int, default=3, help='rounds of warm requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent clients')
+    parser.add_argument('--latency', type=float, default=0.02, help='fake Steam latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.01, help='fake Steam latency jitter in seconds')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='fraction of fake Steam calls answered with 429')
+    parser.add_argument('--fixtures', help='directory of recorded Steam responses to replay')
+    parser.add_argument('--steam-rate-limits', action='store_true', help="keep the client's real Steam rate limits")
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 growth over the baseline')
+    parser.add_argument('--min-delta-ms', type=float, default=10, help='ignore regressions smaller than this')
+    parser.add_argument('--update-baseline', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--output', help='also write the results as json to this file')
+    args = parser.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    fake = FakeSteam(args.latency, args.jitter, args.rate_429, args.fixtures and os.path.abspath(args.fixtures))
+    steam_base = fake.start()
+    base, _ = start_app(steam_base, args.steam_rate_limits)
+
+    scenarios = {}
+    for size in [int(size) for size in args.sizes.split(',')]:
+        for route in USER_ROUTES:
+            scenarios[f'{route} [{size} games]'] = f'{route}?steamid={synthetic_steamid(size)}'
+    for route in STORE_ROUTES:
+        scenarios[route] = route
+    if args.routes:
+        wanted = args.routes.split(',')
+        scenarios = {name: path for name, path in scenarios.items() if any(part in name for part in wanted)}
+
+    results = {}
+    print(f"{'scenario':<60} {'cold':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'req/s':>8} {'calls':>7} {'+rss MB':>8}")
+    for name, path in scenarios.items():
+        result = results[name] = run_scenario(base, path, fake, args.requests, args.concurrency, args.rounds)
+        print(f"{name:<60} {result['cold_ms']:>9} {result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8} "
+              f"{result['throughput_rps']:>8} {result['upstream_calls_per_request']:>7} {result['rss_growth_mb']:>8}"
+              + (f"  ({result['errors']} errors)" if result['errors'] else ''))
+    fake.stop()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump({name: {'p95_ms': result['p95_ms']} for name, result in results.items()}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'Baseline written to {BASELINE_PATH}')
+        return 0
+
+    regressions = compare_with_baseline(results, args.tolerance, args.min_delta_ms)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+from concurrent.futures import as_completed
+from metrics import ContextThreadPoolExecutor
+from collections import namedtuple
+import threading
+import requests
+import os
+
+
+#
+# Fan-out
+# Runs fn over many items on a bounded pool and gives one Outcome(item, value, error) per item.
+# Steam and parsing errors are captured per item instead of failing the whole batch, anything else is raised.
+# Calls for a Steam host also take a slot from that host's limit, which is shared by every fan-out
+# in the process so concurrent requests don't multiply the load on Steam.
+# fn must not fan out on the same host itself, it would hold a slot while waiting for another one.
+#
+FANOUT_MAX_WORKERS = 8
+FANOUT_HOST_LIMITS = {
+    'api.steampowered.com': int(os.getenv('FANOUT_API_CONCURRENCY', 24)),
+    'store.steampowered.com': int(os.getenv('FANOUT_STORE_CONCURRENCY', 8)),
+}
+CAPTURED_ERRORS = (requests.RequestException, ValueError, KeyError)
+
+API_HOST = 'api.steampowered.com'
+STORE_HOST = 'store.steampowered.com'
+
+Outcome = namedtuple('Outcome', 'item value error')
+
+host_slots = {host: threading.BoundedSemaphore(limit) for host, limit in FANOUT_HOST_LIMITS.items()}
+
+
+class FanOutCancelled(requests.RequestException):
+    pass
+
+
+#
+# Yields outcomes as items finish
+# Closing the generator early (e.g. a streaming client went away), or 'timeout' seconds passing,
+# cancels every item that hasn't started. Items still missing at the timeout get a FanOutCancelled error.
+#
+def fan_out_as_completed(fn, items, max_workers=FANOUT_MAX_WORKERS, host=None, timeout=None):
+    items = list(items)
+    if not items:
+        return
+    cancelled = threading.Event()
+    slots = host_slots.get(host)
+
+    def call(item):
+        if cancelled.is_set():
+            raise FanOutCancelled('cancelled')
+        if slots is None:
+            return fn(item)
+        with slots:
+            if cancelled.is_set():
+                raise FanOutCancelled('cancelled')
+            return fn(item)
+
+    executor = ContextThreadPoolExecutor(max_workers=min(len(items), max_workers))
+    pending = {executor.submit(call, item): item for item in items}
+    try:
+        try:
+            for future in as_completed(list(pending), timeout=timeout):
+                item = pending.pop(future)
+                try:
+                    yield Outcome(item, future.result(), None)
+                except CAPTURED_ERRORS as e:
+                    yield Outcome(item, None, e)
+        except TimeoutError:
+            cancelled.set()
+            for item in list(pending.values()):
+                yield Outcome(item, None, FanOutCancelled(f'timed out after {timeout}s'))
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+#
+# Outcomes in the order of 'items'
+#
+def fan_out(fn, items, max_workers=FANOUT_MAX_WORKERS, host=None, timeout=None):
+    items = list(items)
+    outcomes = [None] * len(items)
+    for index, value, error in fan_out_as_completed(lambda i: fn(items[i]), range(len(items)), max_workers, host, timeout):
+        outcomes[index] = Outcome(items[index], value, error)
+    return outcomes
@@ -0,0 +1,138 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import uuid
+import json
+import time
+import os
+
+
+#
+# Background jobs
+# Long per-user computations run on a bounded worker pool instead of inside the request.
+# Jobs, their progress and their results are rows in the jobs table (see create_tables in app.py),
+# so any worker process can answer GET /jobs/<id>.
+# Submitting a job for the same type, steamid and params as one that is queued, running,
+# or finished less than JOB_RESULT_TTL seconds ago returns that job instead of starting another.
+#
+JOB_MAX_WORKERS = int(os.getenv('JOB_MAX_WORKERS', 4))
+JOB_RESULT_TTL = int(os.getenv('JOB_RESULT_TTL', 10 * 60))
+# Queued or running jobs without an update for this long are assumed lost (e.g. the process restarted)
+JOB_STALE_AFTER = int(os.getenv('JOB_STALE_AFTER', 15 * 60))
+JOB_PROGRESS_INTERVAL = 1.0
+
+
+class JobRunner:
+
+    def __init__(self, connect, max_workers=JOB_MAX_WORKERS):
+        self.connect = connect
+        self.handlers = {}
+        # Not a ContextThreadPoolExecutor, a job's Steam calls don't belong to the request that submitted it
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+
+    #
+    # Registers fn(steamid, progress, **params) as the handler of 'job_type'
+    # progress(done, total) may be called from any thread, the return value must be JSON serializable
+    #
+    def handler(self, job_type):
+        def register(fn):
+            self.handlers[job_type] = fn
+            return fn
+        return register
+
+    #
+    # Returns (job_id, created)
+    #
+    def submit(self, job_type, steamid, params=None):
+        if job_type not in self.handlers:
+            raise KeyError(job_type)
+        params = params or {}
+        params_json = json.dumps(params, sort_keys=True)
+        now = time.time()
+
+        conn = self.connect()
+        try:
+            # Take the write lock up front so two submissions can't both miss the existing job
+            conn.execute('BEGIN IMMEDIATE')
+            existing = conn.execute('''
+                SELECT id FROM jobs
+                WHERE type = ? AND steamid = ? AND params = ?
+                AND ((status IN ('queued', 'running') AND updated_at > ?) OR (status = 'done' AND updated_at > ?))
+                ORDER BY created_at DESC LIMIT 1
+            ''', (job_type, steamid, params_json, now - JOB_STALE_AFTER, now - JOB_RESULT_TTL)).fetchone()
+            if existing:
+                conn.commit()
+                return existing[0], False
+
+            job_id = uuid.uuid4().hex
+            conn.execute('''
+                INSERT INTO jobs (id, type, steamid, params, status, created_at, updated_at)
+                VALUES (?, ?, ?, ?, 'queued', ?, ?)
+            ''', (job_id, job_type, steamid, params_json, now, now))
+            conn.commit()
+        finally:
+            conn.close()
+
+        self.executor.submit(self.run, job_id, job_type, steamid, params)
+        return job_id, True
+
+    def get(self, job_id):
+        conn = self.connect()
+        try:
+            row = conn.execute('''
+                SELECT id, type, steamid, params, status, done, total, result, error, created_at, updated_at
+                FROM jobs WHERE id = ?
+            ''', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+
+        job_id, job_type, steamid, params, status, done, total, result, error, created_at, updated_at = row
+        job = {
+            'id': job_id,
+            'type': job_type,
+            'steamid': steamid,
+            'params': json.loads(params),
+            'status': status,
+            'progress': {'done': done, 'total': total},
+            'created_at': created_at,
+            'updated_at': updated_at
+        }
+        if result is not None:
+            job['result'] = json.loads(result)
+        if error is not None:
+            job['error'] = error
+        return job
+
+    def update(self, job_id, **columns):
+        columns['updated_at'] = time.time()
+        conn = self.connect()
+        try:
+            conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ?",
+                list(columns.values()) + [job_id]
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def run(self, job_id, job_type, steamid, params):
+        self.update(job_id, status='running')
+        lock = threading.Lock()
+        last_update = [0.0]
+
+        # Progress is written at most every JOB_PROGRESS_INTERVAL seconds
+        def progress(done, total):
+            with lock:
+                now = time.monotonic()
+                if now - last_update[0] < JOB_PROGRESS_INTERVAL and done < total:
+                    return
+                last_update[0] = now
+                self.update(job_id, done=done, total=total)
+
+        try:
+            result = self.handlers[job_type](steamid, progress, **params)
+            self.update(job_id, status='done', result=json.dumps(result))
+        except Exception as e:
+            print(f"Job {job_id} ({job_type} for {steamid}) failed: {e}")
+            self.update(job_id, status='failed', error=str(e))
@@ -0,0 +1,257 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar, copy_context
+from urllib.parse import urlsplit
+from flask import Response, g, request
+import threading
+import sqlite3
+import cProfile
+import pstats
+import time
+import io
+import os
+
+
+#
+# Instrumentation
+# Per route wall time, upstream Steam calls per interface, cache hits/misses and sqlite time.
+# Totals are exposed in Prometheus text format on /metrics, and each response
+# gets a Server-Timing header for its own request. Its steam entry is the wall time with
+# any Steam call in flight, steam-cumulative adds up the calls even when they overlapped.
+# In debug mode '?profile=1' runs the request under cProfile and writes the report to PROFILE_DIR.
+#
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+
+
+class Histogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Registry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}  # (name, labels) -> value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def render(self):
+        def format_labels(labels, extra=()):
+            pairs = [f'{key}="{value}"' for key, value in tuple(labels) + tuple(extra)]
+            return '{' + ','.join(pairs) + '}' if pairs else ''
+
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in seen:
+                    lines.append(f'# TYPE {name} counter')
+                    seen.add(name)
+                lines.append(f'{name}{format_labels(labels)} {value}')
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if name not in seen:
+                    lines.append(f'# TYPE {name} histogram')
+                    seen.add(name)
+                # Bucket counts are already cumulative, see Histogram.observe
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f'{name}_bucket{format_labels(labels, [("le", bound)])} {count}')
+                lines.append(f'{name}_bucket{format_labels(labels, [("le", "+Inf")])} {histogram.count}')
+                lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+#
+# Numbers for the request being handled
+# Worker threads see them through ContextThreadPoolExecutor
+#
+class RequestStats:
+
+    def __init__(self, route):
+        self._lock = threading.Lock()
+        self.route = route
+        self.steam_calls = 0
+        self.steam_seconds = 0.0
+        self.steam_intervals = []
+        self.sqlite_seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def add_steam_call(self, seconds):
+        end = time.perf_counter()
+        with self._lock:
+            self.steam_calls += 1
+            self.steam_seconds += seconds
+            self.steam_intervals.append((end - seconds, end))
+
+    def steam_wall_seconds(self):
+        """Time with at least one Steam call in flight, concurrent calls are only counted once"""
+        total = 0.0
+        covered_until = None
+        for start, end in sorted(self.steam_intervals):
+            if covered_until is None or start > covered_until:
+                total += end - start
+                covered_until = end
+            elif end > covered_until:
+                total += end - covered_until
+                covered_until = end
+        return total
+
+
+current_stats = ContextVar('request_stats', default=None)
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(copy_context().run, fn, *args, **kwargs)
+
+
+def steam_interface(url):
+    parts = urlsplit(url)
+    path = [part for part in parts.path.split('/') if part]
+    if parts.hostname == 'store.steampowered.com':
+        return 'store/' + (path[-1] if path else '')
+    # /ISteamUser/GetPlayerSummaries/v0002/ -> ISteamUser/GetPlayerSummaries
+    return '/'.join(path[:2])
+
+
+def record_upstream(url, status, seconds):
+    interface = steam_interface(url)
+    registry.inc('steam_requests_total', interface=interface, status=status)
+    registry.observe('steam_request_duration_seconds', seconds, interface=interface)
+    stats = current_stats.get()
+    if stats:
+        stats.add_steam_call(seconds)
+        registry.inc('route_steam_requests_total', route=stats.route)
+
+
+def record_cache(cache, hits=0, misses=0):
+    if hits:
+        registry.inc('cache_requests_total', hits, cache=cache, result='hit')
+    if misses:
+        registry.inc('cache_requests_total', misses, cache=cache, result='miss')
+    stats = current_stats.get()
+    if stats:
+        stats.add(cache_hits=hits, cache_misses=misses)
+
+
+def record_sqlite(seconds):
+    registry.observe('sqlite_query_duration_seconds', seconds)
+    stats = current_stats.get()
+    if stats:
+        stats.add(sqlite_seconds=seconds)
+
+
+#
+# sqlite3 connection that times every statement, pass as factory= to sqlite3.connect
+#
+class TimedCursor(sqlite3.Cursor):
+
+    def execute(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            record_sqlite(time.perf_counter() - start)
+
+    def executemany(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        finally:
+            record_sqlite(time.perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args, **kwargs):
+        return self.cursor().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self.cursor().executemany(*args, **kwargs)
+
+
+def init_app(app):
+
+    @app.before_request
+    def start_request_stats():
+        g.request_start = time.perf_counter()
+        g.request_stats = RequestStats(request.endpoint or 'unknown')
+        g.request_stats_token = current_stats.set(g.request_stats)
+        if app.debug and request.args.get('profile') == '1':
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def finish_request_stats(response):
+        stats = g.get('request_stats')
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - g.request_start
+
+        profiler = g.pop('profiler', None)
+        if profiler:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f'{stats.route}-{int(time.time() * 1000)}.prof')
+            profiler.dump_stats(path)
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(40)
+            app.logger.info('Profile for %s written to %s\n%s', request.full_path, path, report.getvalue())
+            response.headers['X-Profile'] = path
+
+        registry.observe('route_duration_seconds', elapsed, route=stats.route)
+        response.headers['Server-Timing'] = ', '.join([
+            f'app;dur={elapsed * 1000:.1f}',
+            f'steam;dur={stats.steam_wall_seconds() * 1000:.1f};desc="{stats.steam_calls} calls"',
+            f'steam-cumulative;dur={stats.steam_seconds * 1000:.1f};desc="summed over concurrent calls"',
+            f'sqlite;dur={stats.sqlite_seconds * 1000:.1f}',
+            f'cache;desc="{stats.cache_hits} hits {stats.cache_misses} misses"',
+        ])
+        return response
+
+    @app.teardown_request
+    def reset_request_stats(exc):
+        token = g.pop('request_stats_token', None)
+        if token is not None:
+            current_stats.reset(token)
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
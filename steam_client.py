@@ -0,0 +1,268 @@
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from collections import deque
+from dotenv import load_dotenv
+import threading
+import requests
+import metrics
+import random
+import time
+import os
+
+
+load_dotenv()
+
+#
+# Steam HTTP client
+# All calls to the Steam Web API and the store API go through here.
+# One pooled requests.Session (keep-alive), default timeouts,
+# a token bucket per host, and jittered exponential backoff on 429/5xx.
+# Each interface (GetOwnedGames, appdetails, ...) has a circuit breaker and a cap on requests in flight,
+# so a Steam outage makes calls fail fast with SteamUnavailable instead of tying up every worker.
+#
+STEAM_POOL_SIZE = int(os.getenv('STEAM_POOL_SIZE', 32))
+STEAM_CONNECT_TIMEOUT = float(os.getenv('STEAM_CONNECT_TIMEOUT', 3.05))
+STEAM_READ_TIMEOUT = float(os.getenv('STEAM_READ_TIMEOUT', 15))
+STEAM_MAX_RETRIES = int(os.getenv('STEAM_MAX_RETRIES', 3))
+STEAM_BACKOFF_BASE = float(os.getenv('STEAM_BACKOFF_BASE', 0.5))
+STEAM_BACKOFF_MAX = float(os.getenv('STEAM_BACKOFF_MAX', 8))
+
+# Requests per second and burst size for each Steam host
+STEAM_RATE_LIMITS = {
+    'api.steampowered.com': (
+        float(os.getenv('STEAM_API_RATE', 20)),
+        int(os.getenv('STEAM_API_BURST', 40)),
+    ),
+    'store.steampowered.com': (
+        float(os.getenv('STEAM_STORE_RATE', 1)),
+        int(os.getenv('STEAM_STORE_BURST', 20)),
+    ),
+}
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Errors worth another attempt, Steam regularly drops connections mid-response
+RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.ContentDecodingError)
+
+# Requests in flight per interface, callers wait up to STEAM_IN_FLIGHT_WAIT seconds for a slot
+STEAM_MAX_IN_FLIGHT = int(os.getenv('STEAM_MAX_IN_FLIGHT', 32))
+STEAM_IN_FLIGHT_WAIT = float(os.getenv('STEAM_IN_FLIGHT_WAIT', 2))
+# Longest a call waits for a rate limit token before giving up with SteamUnavailable
+STEAM_RATE_WAIT = float(os.getenv('STEAM_RATE_WAIT', 5))
+
+# A breaker opens when, over the calls of the last BREAKER_WINDOW seconds (at least BREAKER_MIN_CALLS),
+# the share of failures (errors, 429 and 5xx) or of calls slower than BREAKER_SLOW_SECONDS gets too high.
+# After BREAKER_OPEN_SECONDS one probe call is let through, its outcome closes or reopens the breaker.
+BREAKER_WINDOW = float(os.getenv('STEAM_BREAKER_WINDOW', 30))
+BREAKER_MIN_CALLS = int(os.getenv('STEAM_BREAKER_MIN_CALLS', 10))
+BREAKER_ERROR_RATE = float(os.getenv('STEAM_BREAKER_ERROR_RATE', 0.5))
+BREAKER_SLOW_SECONDS = float(os.getenv('STEAM_BREAKER_SLOW_SECONDS', 5))
+BREAKER_SLOW_RATE = float(os.getenv('STEAM_BREAKER_SLOW_RATE', 0.5))
+BREAKER_OPEN_SECONDS = float(os.getenv('STEAM_BREAKER_OPEN_SECONDS', 30))
+
+# Point a Steam host somewhere else, e.g. the fake Steam server used by bench/
+# STEAM_API_BASE=http://127.0.0.1:8901 STEAM_STORE_BASE=http://127.0.0.1:8901
+STEAM_HOST_OVERRIDES = {
+    host: base.rstrip('/')
+    for host, base in (
+        ('api.steampowered.com', os.getenv('STEAM_API_BASE')),
+        ('store.steampowered.com', os.getenv('STEAM_STORE_BASE')),
+    )
+    if base
+}
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Take a token, False when none frees up within timeout seconds"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class SteamUnavailable(requests.RequestException):
+
+    def __init__(self, interface, reason, retry_after=None):
+        super().__init__(f'Steam {interface} unavailable: {reason}')
+        self.interface = interface
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+
+    def __init__(self, interface):
+        self.interface = interface
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self.probing = False
+        self.calls = deque()  # (timestamp, failed, slow) of the calls in the window
+        self.failures = 0
+        self.slow = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= BREAKER_OPEN_SECONDS:
+                self.state = 'half_open'
+                self.probing = False
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def release_probe(self):
+        with self._lock:
+            if self.state == 'half_open':
+                self.probing = False
+
+    def retry_after(self):
+        return max(0.0, self.opened_at + BREAKER_OPEN_SECONDS - time.monotonic())
+
+    def record(self, failed, seconds):
+        slow = seconds > BREAKER_SLOW_SECONDS
+        with self._lock:
+            now = time.monotonic()
+            if self.state == 'half_open':
+                self.probing = False
+                if failed or slow:
+                    self.open(now)
+                else:
+                    self.state = 'closed'
+                    self.calls.clear()
+                    self.failures = self.slow = 0
+                return
+
+            self.calls.append((now, failed, slow))
+            self.failures += failed
+            self.slow += slow
+            while self.calls and self.calls[0][0] < now - BREAKER_WINDOW:
+                _, old_failed, old_slow = self.calls.popleft()
+                self.failures -= old_failed
+                self.slow -= old_slow
+
+            if self.state == 'closed' and len(self.calls) >= BREAKER_MIN_CALLS and (
+                self.failures / len(self.calls) >= BREAKER_ERROR_RATE or self.slow / len(self.calls) >= BREAKER_SLOW_RATE
+            ):
+                self.open(now)
+
+    def open(self, now):
+        self.state = 'open'
+        self.opened_at = now
+        self.calls.clear()
+        self.failures = self.slow = 0
+        metrics.registry.inc('steam_circuit_opened_total', interface=self.interface)
+        print(f"Circuit breaker for Steam {self.interface} opened for {BREAKER_OPEN_SECONDS}s")
+
+
+class SteamClient:
+
+    def __init__(self, pool_size=STEAM_POOL_SIZE, timeout=(STEAM_CONNECT_TIMEOUT, STEAM_READ_TIMEOUT),
+                 max_retries=STEAM_MAX_RETRIES, rate_limits=STEAM_RATE_LIMITS):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(rate_limits) or 1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.limiters = {host: TokenBucket(rate, burst) for host, (rate, burst) in rate_limits.items()}
+        self.breakers = {}
+        self.in_flight = {}
+        self._lock = threading.Lock()
+
+    def interface_guards(self, interface):
+        with self._lock:
+            if interface not in self.breakers:
+                self.breakers[interface] = CircuitBreaker(interface)
+                self.in_flight[interface] = threading.BoundedSemaphore(STEAM_MAX_IN_FLIGHT)
+            return self.breakers[interface], self.in_flight[interface]
+
+    def backoff(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), STEAM_BACKOFF_MAX)
+        # Full jitter, so concurrent workers don't retry in lockstep
+        return random.uniform(0, min(STEAM_BACKOFF_MAX, STEAM_BACKOFF_BASE * 2 ** attempt))
+
+    def get(self, url, params=None, timeout=None, **kwargs):
+        parts = urlsplit(url)
+        limiter = self.limiters.get(parts.hostname)
+        interface = metrics.steam_interface(url)
+        breaker, in_flight = self.interface_guards(interface)
+        request_url = url
+        if parts.hostname in STEAM_HOST_OVERRIDES:
+            request_url = STEAM_HOST_OVERRIDES[parts.hostname] + url[len(f'{parts.scheme}://{parts.netloc}'):]
+        for attempt in range(self.max_retries + 1):
+            # Don't wait for a slot or a rate limit token just to be turned away by an open breaker
+            if breaker.state == 'open' and breaker.retry_after() > 0:
+                metrics.registry.inc('steam_rejected_total', interface=interface, reason='circuit_open')
+                raise SteamUnavailable(interface, 'circuit open', breaker.retry_after())
+            # Slot first, so the in flight cap also bounds how many callers queue on the limiter
+            if not in_flight.acquire(timeout=STEAM_IN_FLIGHT_WAIT):
+                metrics.registry.inc('steam_rejected_total', interface=interface, reason='in_flight')
+                raise SteamUnavailable(interface, f'more than {STEAM_MAX_IN_FLIGHT} requests in flight')
+            try:
+                if limiter and not limiter.acquire(timeout=STEAM_RATE_WAIT):
+                    metrics.registry.inc('steam_rejected_total', interface=interface, reason='rate_limit')
+                    raise SteamUnavailable(interface, f'no rate limit token within {STEAM_RATE_WAIT}s', STEAM_RATE_WAIT)
+                if not breaker.allow():
+                    metrics.registry.inc('steam_rejected_total', interface=interface, reason='circuit_open')
+                    raise SteamUnavailable(interface, 'circuit open', breaker.retry_after())
+                start = time.perf_counter()
+                recorded = False
+                try:
+                    response = self.session.get(request_url, params=params, timeout=timeout or self.timeout, **kwargs)
+                except requests.RequestException as e:
+                    breaker.record(True, time.perf_counter() - start)
+                    recorded = True
+                    metrics.record_upstream(url, type(e).__name__, time.perf_counter() - start)
+                    if attempt == self.max_retries or not isinstance(e, RETRY_EXCEPTIONS):
+                        raise
+                    error = e
+                else:
+                    error = None
+                    breaker.record(response.status_code in RETRY_STATUS_CODES, time.perf_counter() - start)
+                    recorded = True
+                finally:
+                    # Whatever went wrong, a half open breaker must not keep waiting for this probe
+                    if not recorded:
+                        breaker.release_probe()
+            finally:
+                in_flight.release()
+
+            if error is not None:
+                time.sleep(self.backoff(attempt))
+                continue
+            metrics.record_upstream(url, response.status_code, time.perf_counter() - start)
+
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                response.close()
+                time.sleep(self.backoff(attempt, response))
+                continue
+            return response
+
+
+client = SteamClient()
+
+
+def get(url, params=None, timeout=None, **kwargs):
+    return client.get(url, params=params, timeout=timeout, **kwargs)
@@ -0,0 +1,13 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+
+
+def test_steam_wall_time_counts_overlapping_calls_once():
+    stats = metrics.RequestStats('route')
+    stats.steam_intervals = [(0.0, 1.0), (0.5, 1.5), (0.2, 0.4), (3.0, 4.0)]
+    stats.steam_seconds = 3.7
+    assert stats.steam_wall_seconds() == 2.5
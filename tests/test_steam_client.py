@@ -0,0 +1,73 @@
+import requests
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import steam_client
+import metrics
+
+URL = 'http://api.steampowered.com/IPlayerService/GetOwnedGames/v0001/'
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {}
+
+
+def half_open_client(monkeypatch, outcome):
+    client = steam_client.SteamClient(max_retries=0, rate_limits={})
+    breaker, _ = client.interface_guards(metrics.steam_interface(URL))
+    # Opened long enough ago that the next call is the half open probe
+    breaker.state = 'open'
+    breaker.opened_at = -steam_client.BREAKER_OPEN_SECONDS
+
+    def get(*args, **kwargs):
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(client.session, 'get', get)
+    return client, breaker
+
+
+def test_failed_probe_reopens_on_any_request_exception(monkeypatch):
+    client, breaker = half_open_client(monkeypatch, requests.exceptions.ChunkedEncodingError('dropped'))
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        client.get(URL)
+    assert breaker.state == 'open'
+    assert not breaker.probing
+
+
+def test_probe_is_released_on_unexpected_errors(monkeypatch):
+    client, breaker = half_open_client(monkeypatch, RuntimeError('boom'))
+    with pytest.raises(RuntimeError):
+        client.get(URL)
+    assert breaker.state == 'half_open'
+    assert not breaker.probing
+    assert breaker.allow()
+
+
+def test_successful_probe_closes(monkeypatch):
+    client, breaker = half_open_client(monkeypatch, FakeResponse())
+    assert client.get(URL).status_code == 200
+    assert breaker.state == 'closed'
+
+
+def test_token_bucket_gives_up_past_timeout():
+    bucket = steam_client.TokenBucket(rate=0.5, capacity=1)
+    assert bucket.acquire(timeout=0)
+    assert not bucket.acquire(timeout=0.1)
+
+
+def test_rate_limit_wait_is_bounded(monkeypatch):
+    monkeypatch.setattr(steam_client, 'STEAM_RATE_WAIT', 0.1)
+    client = steam_client.SteamClient(max_retries=0, rate_limits={'api.steampowered.com': (0.5, 1)})
+    monkeypatch.setattr(client.session, 'get', lambda *args, **kwargs: FakeResponse())
+    _, in_flight = client.interface_guards(metrics.steam_interface(URL))
+    assert client.get(URL).status_code == 200
+    with pytest.raises(steam_client.SteamUnavailable):
+        client.get(URL)
+    # The slot taken before waiting on the limiter is handed back
+    assert in_flight._value == steam_client.STEAM_MAX_IN_FLIGHT